@@ -0,0 +1,169 @@
+"""
+file: analysis.py
+author: Louis Jacobowitz (ljacobo@ncsu.edu)
+
+Analysis of a composed score's polyphony: how many notes sound at once, per instrument and overall, and how much
+CPU that is predicted to take in real time, from a micro-benchmark of each orchestra instrument. Also a voice
+limiter that drops or shortens the least important notes wherever the predicted load would exceed a budget.
+"""
+from collections import Counter
+import heapq
+from time import perf_counter
+
+
+def polyphony(instruments):
+    """
+    Runs a sweep line over the notes of the given instruments, and returns how many notes sound at every point
+    in the piece where that changes. A note sounds from its start up to (not including) its end.
+    :param instruments: A dict of Instruments, where key is name/role
+    :return: A list of (beat, counts) pairs in order of beat, where counts is a Counter from instrument name to
+             how many of its notes sound from that beat until the next pair's beat
+    """
+    events = []
+    for name, instr in instruments.items():
+        for note in instr.note_sequence:
+            if note["duration"] > 0:
+                events.append((note["start"], 1, name))
+                events.append((note["start"] + note["duration"], -1, name))
+    events.sort(key=lambda event: (event[0], event[1]))   # at the same beat, endings come before starts
+    counts = Counter()
+    result = []
+    for i, (beat, change, name) in enumerate(events):
+        counts[name] += change
+        if i + 1 == len(events) or events[i + 1][0] != beat:
+            result.append((beat, +counts))   # unary + drops instruments with nothing sounding
+    return result
+
+
+def _time_performance(orc, sco):
+    """ Returns how many seconds Csound takes to perform the given orchestra and score, with no sound output. """
+    import ctcsound
+    c = ctcsound.Csound()
+    c.setOption("-n")
+    c.compileOrc(orc)
+    c.readScore(sco)
+    c.start()
+    start = perf_counter()
+    c.perform()
+    seconds = perf_counter() - start
+    c.reset()
+    return seconds
+
+
+def measure_costs(orc, header, instruments, voices=8, beats=8, tempo=217):
+    """
+    Micro-benchmarks every orchestra instrument the given instruments' notes use, by performing several copies of
+    one of its real notes at once, and subtracting the time taken to perform nothing for as long.
+    :param orc: The orchestra, as a string
+    :param header: The score's header (f-tables, tempo), as a string
+    :param instruments: A dict of Instruments, where key is name/role
+    :param voices: How many copies of the note to sound at once
+    :param beats: How long each copy lasts, in beats
+    :param tempo: The tempo set in the header, in beats per minute
+    :return: A dict from orchestra instrument (e.g. "i4") to its cost: CPU seconds per second of one note sounding
+    """
+    seconds = beats * 60 / tempo
+    idle = _time_performance(orc, header + "f0 {}\n".format(beats))
+    templates = {}
+    for instr in instruments.values():
+        for note in instr.note_sequence:
+            templates.setdefault(note["instrument"], note)
+    costs = {}
+    for name, note in templates.items():
+        sco = header + "".join(note.line(start=0, duration=beats) + "\n" for _ in range(voices))
+        costs[name] = max(_time_performance(orc, sco) - idle, 0) / (voices * seconds)
+    return costs
+
+
+def predicted_load(instruments, costs):
+    """
+    Predicts the CPU load of performing the given instruments' notes in real time, where 1.0 is one core fully busy.
+    :param instruments: A dict of Instruments, where key is name/role
+    :param costs: A dict from orchestra instrument (e.g. "i4") to its cost, as from measure_costs()
+    :return: A list of (beat, load) pairs in order of beat, each holding from that beat until the next pair's beat
+    """
+    events = []
+    for instr in instruments.values():
+        for note in instr.note_sequence:
+            cost = costs.get(note["instrument"], 0)
+            if note["duration"] > 0 and cost:
+                events.append((note["start"], cost))
+                events.append((note["start"] + note["duration"], -cost))
+    events.sort(key=lambda event: (event[0], event[1]))
+    load = 0
+    result = []
+    for i, (beat, change) in enumerate(events):
+        load += change
+        if i + 1 == len(events) or events[i + 1][0] != beat:
+            result.append((beat, max(load, 0)))
+    return result
+
+
+def limit_voices(instruments, costs, budget=0.8, priority=None):
+    """
+    Drops or shortens notes so that the predicted load (as from predicted_load()) never exceeds the budget.
+    Goes through the notes in order of start time; whenever a new note would push the load over the budget, the
+    least important note sounding (or the new note itself) is cut: a note that has already started is shortened
+    to end there, and one that hasn't is dropped. Changes the instruments' note sequences in place.
+    :param instruments: A dict of Instruments, where key is name/role
+    :param costs: A dict from orchestra instrument (e.g. "i4") to its cost, as from measure_costs()
+    :param budget: The highest load to allow, where 1.0 is one core fully busy
+    :param priority: A list of instrument names, most important first. Defaults to the order of instruments.
+    :return: A dict from instrument name to a Counter of how many of its notes were "dropped" and "shortened"
+    """
+    rank = {name: i for i, name in enumerate(priority or instruments)}
+    notes = sorted(((note["start"], rank.get(name, len(rank)), name, i, note)
+                    for name, instr in instruments.items() for i, note in enumerate(instr.note_sequence)),
+                   key=lambda entry: entry[0])
+    kept = {name: dict(enumerate(instr.note_sequence)) for name, instr in instruments.items()}
+    report = {name: Counter() for name in instruments}
+    active = []      # heap of (end, name, index) for notes still sounding
+    sounding = {}    # (name, index) -> (rank, start, cost) for notes still sounding and not yet cut
+    load = 0
+    for start, note_rank, name, index, note in notes:
+        while active and active[0][0] <= start:
+            end, ended_name, ended_index = heapq.heappop(active)
+            if (ended_name, ended_index) in sounding:
+                load -= sounding.pop((ended_name, ended_index))[2]
+        cost = costs.get(note["instrument"], 0)
+        if note["duration"] <= 0 or not cost:
+            continue
+        sounding[(name, index)] = (note_rank, start, cost)
+        heapq.heappush(active, (start + note["duration"], name, index))
+        load += cost
+        while load > budget and sounding:
+            # least important first; among equals, the one that started last
+            victim = max(sounding, key=lambda key: (sounding[key][0], sounding[key][1]))
+            victim_rank, victim_start, victim_cost = sounding.pop(victim)
+            load -= victim_cost
+            victim_name, victim_index = victim
+            if victim_start < start:
+                kept[victim_name][victim_index] = kept[victim_name][victim_index].replace(
+                    duration=start - victim_start)
+                report[victim_name]["shortened"] += 1
+            else:
+                del kept[victim_name][victim_index]
+                report[victim_name]["dropped"] += 1
+    for name, instr in instruments.items():
+        instr.note_sequence = [kept[name][i] for i in sorted(kept[name])]
+    return report
+
+
+def summary(instruments, costs=None):
+    """ Returns the peak polyphony per instrument and overall (and the peak predicted load, given costs). """
+    peaks = Counter()
+    peak_total, peak_beat = 0, None
+    for beat, counts in polyphony(instruments):
+        for name, count in counts.items():
+            peaks[name] = max(peaks[name], count)
+        if sum(counts.values()) > peak_total:
+            peak_total, peak_beat = sum(counts.values()), beat
+    lines = ["{:<16}{:>14}".format("instrument", "peak notes")]
+    for name in instruments:
+        lines.append("{:<16}{:>14}".format(name, peaks[name]))
+    lines.append("{:<16}{:>14}  (at beat {})".format("all", peak_total, peak_beat))
+    if costs:
+        load = predicted_load(instruments, costs)
+        beat, peak = max(load, key=lambda pair: pair[1], default=(None, 0))
+        lines.append("peak predicted load: {:.2f} cores (at beat {})".format(peak, beat))
+    return "\n".join(lines)
@@ -0,0 +1,211 @@
+"""
+file: benchmark.py
+author: Louis Jacobowitz (ljacobo@ncsu.edu)
+
+Times the pieces of the composition pipeline at several scales: each heuristic on its own, compose() end-to-end,
+writing the score, and (optionally) rendering it with Csound. Prints a summary and writes the results as JSON,
+so that runs from different commits can be diffed. Also checks that the notes composed for 810 beats are exactly
+the same as those in golden_810.sco, the score written by the original implementation of compose().
+
+Usage: python benchmark.py [--beats 810 10000 100000 1000000] [--render] [--golden golden_810.sco] [--json out.json]
+"""
+import argparse
+import hashlib
+import io
+import json
+import platform
+import time
+
+import heuristics
+import main
+from instrument import write_score
+
+
+def timed(function, *args, **kwargs):
+    """ Calls the given function, and returns (seconds taken, return value). """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def heuristic_cases():
+    """
+    Returns the heuristics to time individually, as a list of (name, function taking a number) pairs, with the
+    bases the piece actually uses.
+    """
+    return [
+        ("ones_in_binary_repr", heuristics.ones_in_binary_repr),
+        ("zeroes_in_binary_repr", heuristics.zeroes_in_binary_repr),
+        ("_base(n, 12)", lambda n: heuristics._base(n, 12)),
+        ("digital_sum", heuristics.digital_sum),
+        ("digital_root", heuristics.digital_root),
+        ("digital_root(n**3, 11)", lambda n: heuristics.digital_root(n ** 3, 11)),
+        ("palindromes(n, 16..2)", lambda n: heuristics.palindromes(n, range(16, 1, -1))),
+        ("is_palindrome", heuristics.is_palindrome),
+        ("last_nonzero_digit", heuristics.last_nonzero_digit),
+        ("is_prime", heuristics.is_prime),
+        ("highest_digit(n, 12)", lambda n: heuristics.highest_digit(n, 12)),
+        ("lowest_digit", heuristics.lowest_digit),
+        ("prime_factors", heuristics.prime_factors),
+        ("sum_of_prime_factors", heuristics.sum_of_prime_factors),
+        ("divisors", heuristics.divisors),
+        ("number_of_divisors", heuristics.number_of_divisors),
+        ("sum_of_divisors", heuristics.sum_of_divisors),
+        ("is_fibonacci_number(sum_of_divisors)", lambda n: heuristics.is_fibonacci_number(
+            heuristics.sum_of_divisors(n))),
+        ("is_happy_number", heuristics.is_happy_number),
+        ("happy_bases", heuristics.happy_bases),
+        ("next_beat_with('prime')", lambda n: heuristics.next_beat_with("prime", n)),
+        ("next_beat_with('happy')", lambda n: heuristics.next_beat_with("happy", n)),
+    ]
+
+
+def bench_heuristics(count):
+    """
+    Times each heuristic over the beats 3..count, in order, as compose() would call them.
+    Tables and caches the heuristics keep (sieves, happy chains) are built by the calls being timed, and carry
+    over to the functions timed after them.
+    :return: A dict from heuristic name to {"seconds", "us_per_call"}
+    """
+    results = {}
+    numbers = range(3, count)
+    for name, function in heuristic_cases():
+        seconds, _ = timed(lambda: [function(n) for n in numbers])
+        results[name] = {"seconds": seconds, "us_per_call": seconds / len(numbers) * 1e6}
+    return results
+
+
+def score_text(instruments):
+    """ Returns the whole score for the given (composed) instruments, as main.py writes it. """
+    out = io.StringIO()
+    write_score(out, main.init_score(), instruments.values())
+    return out.getvalue()
+
+
+def bench_compose(beats):
+    """
+    Times compose() end-to-end for the given number of beats, and then the score output for its notes.
+    :return: A tuple (result dict, instruments)
+    """
+    instruments = main.init_instruments()
+    seconds, _ = timed(main.compose, instruments, beats)
+    notes = sum(len(instr.note_sequence) for instr in instruments.values())
+    output_seconds, _ = timed(lambda: [instr.output_note_sequence() for instr in instruments.values()])
+    result = {
+        "beats": beats,
+        "notes": notes,
+        "compose_seconds": seconds,
+        "compose_us_per_beat": seconds / beats * 1e6,
+        "output_note_sequence_seconds": output_seconds,
+        "output_us_per_note": output_seconds / max(notes, 1) * 1e6,
+    }
+    return result, instruments
+
+
+def bench_render(instruments, beats):
+    """
+    Times rendering the given composed instruments with Csound to a throwaway WAV file, and compares that to the
+    length of the piece. A real-time factor below 1 means the piece renders faster than it plays.
+    """
+    with open('inst.orc') as orc_file:
+        orc = orc_file.read()
+    sco = score_text(instruments)
+    seconds, _ = timed(main.perform, orc, sco, "benchmark.wav")
+    ends = [note["start"] + note["duration"] for instr in instruments.values() for note in instr.note_sequence]
+    duration = max(ends, default=0) * 60 / main.TEMPO
+    return {"beats": beats, "render_seconds": seconds, "piece_seconds": duration,
+            "real_time_factor": seconds / duration if duration else None}
+
+
+def note_lines(sco):
+    """ Returns the lines of a score that are notes ("i" statements), leaving out the header. """
+    return [line for line in sco.splitlines() if line.startswith("i")]
+
+
+def check_golden(path, instruments):
+    """
+    Compares the notes composed for these instruments to those of the golden score at the given path: by default,
+    the score the original implementation of compose() wrote for 810 beats. Only notes are compared, since the
+    header's formatting has changed since then. If there is no golden score there yet, records this one there.
+    :return: A dict describing the outcome, with "match" True, False, or None if the score was just recorded
+    """
+    sco = score_text(instruments)
+    digest = hashlib.sha256(sco.encode()).hexdigest()
+    try:
+        with open(path) as golden_file:
+            golden = golden_file.read()
+    except FileNotFoundError:
+        with open(path, 'w') as golden_file:
+            golden_file.write(sco)
+        return {"path": path, "sha256": digest, "match": None}
+    ours, theirs = note_lines(sco), note_lines(golden)
+    result = {"path": path, "sha256": digest, "match": ours == theirs}
+    if ours != theirs:
+        first = next((i for i, (a, b) in enumerate(zip(ours, theirs)) if a != b), min(len(ours), len(theirs)))
+        result["first_difference"] = {"note": first + 1,
+                                      "golden": theirs[first] if first < len(theirs) else None,
+                                      "current": ours[first] if first < len(ours) else None}
+    return result
+
+
+def print_summary(results):
+    """ Prints the benchmark results as tables. """
+    print("{:<40}{:>12}{:>14}".format("heuristic", "seconds", "us/call"))
+    for name, r in sorted(results["heuristics"].items(), key=lambda item: -item[1]["seconds"]):
+        print("{:<40}{:>12.4f}{:>14.2f}".format(name, r["seconds"], r["us_per_call"]))
+    print()
+    print("{:>10}{:>10}{:>12}{:>12}{:>14}{:>12}".format("beats", "notes", "compose s", "us/beat", "output s",
+                                                        "us/note"))
+    for r in results["compose"]:
+        print("{:>10}{:>10}{:>12.3f}{:>12.2f}{:>14.3f}{:>12.2f}".format(
+            r["beats"], r["notes"], r["compose_seconds"], r["compose_us_per_beat"],
+            r["output_note_sequence_seconds"], r["output_us_per_note"]))
+    if results.get("render"):
+        r = results["render"]
+        print()
+        print("render of {} beats: {:.2f} s for {:.2f} s of audio, real-time factor {:.3f}".format(
+            r["beats"], r["render_seconds"], r["piece_seconds"], r["real_time_factor"]))
+    if results.get("golden"):
+        r = results["golden"]
+        print()
+        outcome = {True: "matches", False: "DIFFERS", None: "recorded"}[r["match"]]
+        print("golden score {}: {}".format(r["path"], outcome))
+        if r["match"] is False:
+            print("  first difference at note {}:\n    golden:  {}\n    current: {}".format(
+                r["first_difference"]["note"], r["first_difference"]["golden"], r["first_difference"]["current"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the heuristics, compose() and rendering.")
+    parser.add_argument("--beats", type=int, nargs="+", default=[810, 10000, 100000, 1000000],
+                        help="the piece lengths to time compose() at (default 810 10000 100000 1000000)")
+    parser.add_argument("--heuristic-beats", type=int, default=10000,
+                        help="how many beats to time each heuristic over (default 10000)")
+    parser.add_argument("--render", action="store_true",
+                        help="also time rendering the shortest piece with Csound")
+    parser.add_argument("--golden", metavar="PATH", default="golden_810.sco",
+                        help="check the notes composed for 810 beats against this score (default golden_810.sco, "
+                             "written by the original compose()), or record it there if missing; '' to skip")
+    parser.add_argument("--json", metavar="PATH", default="benchmark.json",
+                        help="where to write the results (default benchmark.json)")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "heuristics": bench_heuristics(args.heuristic_beats),
+        "compose": [],
+    }
+    for beats in sorted(args.beats):
+        result, instruments = bench_compose(beats)
+        results["compose"].append(result)
+        if args.render and "render" not in results:
+            results["render"] = bench_render(instruments, beats)
+    if args.golden:
+        instruments = main.init_instruments()
+        main.compose(instruments, 810)
+        results["golden"] = check_golden(args.golden, instruments)
+
+    print_summary(results)
+    with open(args.json, 'w') as json_file:
+        json.dump(results, json_file, indent=2)
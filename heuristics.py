@@ -4,8 +4,19 @@ author: Louis Jacobowitz (ljacobo@ncsu.edu)
 
 This file contains many standalone methods for determining various properties of numbers.
 """
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from time import perf_counter
+import numpy as np
+
 primes = [2, 3]
+smallest_prime_factors = [0, 1, 2, 3]
+divisor_counts = []
+divisor_sums = []
+divisor_lists = []
 fibonacci_numbers = [0, 1]
+fibonacci_set = {0, 1}
+happy_numbers = {}  # base -> {number: whether it is happy in that base}, for every number seen on a happy chain
 
 
 def ones_in_binary_repr(num):
@@ -79,16 +90,37 @@ def last_nonzero_digit(num, base=10):
     return without_zeros[-1]
 
 
+def sieve(limit):
+    """
+    Precomputes the smallest prime factor of every integer below the given limit, with a sieve of Eratosthenes,
+    so that is_prime() and prime_factors() become table lookups. Also rebuilds the list of primes below the limit.
+    Does nothing if the table is already at least that large.
+    :param limit: One more than the largest number that will be queried (e.g. the total number of beats)
+    """
+    global primes, smallest_prime_factors
+    if limit <= len(smallest_prime_factors):
+        return
+    spf = [0] * limit
+    # Marking multiples of the largest candidates first means the smallest prime factor is written last, and
+    #   every composite n is reached by its smallest prime factor p, since p*p <= n.
+    root = int((limit - 1) ** 0.5)
+    while root * root > limit - 1:     # the float square root can be off by one for very large limits
+        root -= 1
+    while (root + 1) * (root + 1) <= limit - 1:
+        root += 1
+    for p in range(root, 1, -1):
+        spf[p*p::p] = [p] * len(range(p*p, limit, p))
+    smallest_prime_factors = [p or i for i, p in enumerate(spf)]
+    primes = [i for i in range(2, limit) if smallest_prime_factors[i] == i]
+
+
 def is_prime(num):
-    """ Returns True if the given number is prime, False otherwise. Updates list of primes as number grows. """
-    global primes
-    while num > primes[-1]:
-        n = primes[-1] + 2
-        y = [bool(n % p) for p in primes]
-        while not all(n % p for p in primes):
-            n += 2
-        primes.append(n)
-    return num in primes
+    """ Returns True if the given number is prime, False otherwise. Grows the sieve as the number grows. """
+    if num < 2:
+        return False
+    if num >= len(smallest_prime_factors):
+        sieve(2 * num)
+    return smallest_prime_factors[num] == num
 
 
 def highest_digit(num, base=10):
@@ -103,16 +135,13 @@ def lowest_digit(num, base=10):
 
 def prime_factors(num):
     """ Returns a list of the prime factors of the given number, excluding 1 """
-    if is_prime(num):
-        return [num]
-    n = num
+    if num >= len(smallest_prime_factors):
+        sieve(2 * num)
     factors = []
-    for p in primes:
-        while n % p == 0:
-            factors.append(p)
-            n /= p
-        if n == 1:
-            break
+    while num > 1:
+        p = smallest_prime_factors[num]
+        factors.append(p)
+        num //= p
     return factors
 
 
@@ -121,34 +150,476 @@ def sum_of_prime_factors(num):
     return sum(prime_factors(num))
 
 
+def divisor_sieve(limit, lists=False):
+    """
+    Precomputes the number and sum of the divisors (including 1 but not the number itself) of every integer below
+    the given limit, in one O(N log N) pass that adds each candidate divisor to all of its multiples.
+    Tables that are already at least that large are kept as they are: they are never shrunk, and the divisor lists
+    are kept even when they aren't asked for.
+    :param limit: One more than the largest number that will be queried (e.g. the total number of beats)
+    :param lists: If True, also stores the full, ascending list of divisors of every integer below the limit
+    """
+    global divisor_counts, divisor_sums, divisor_lists
+    grow_tables = limit > len(divisor_counts)
+    grow_lists = lists and limit > len(divisor_lists)
+    if not grow_tables and not grow_lists:
+        return
+    if grow_tables:
+        counts = [0] * limit
+        sums = [0] * limit
+    if grow_lists:
+        divs = [[] for _ in range(limit)]
+    for d in range(1, limit // 2 + 1):
+        multiples = range(2 * d, limit, d)
+        if grow_tables:
+            for m in multiples:
+                counts[m] += 1
+                sums[m] += d
+        if grow_lists:
+            for m in multiples:
+                divs[m].append(d)
+    if grow_tables:
+        divisor_counts, divisor_sums = counts, sums
+    if grow_lists:
+        divisor_lists = divs
+
+
 def divisors(num):
     """ Returns a list of all integers that divide this number, including 1 but not including this number """
-    return [i for i in range(1, num//2+1) if num % i == 0]
+    if num < len(divisor_lists):
+        return list(divisor_lists[num])
+    # Builds every divisor from the prime factorization. Repeated prime factors come out adjacent, so each further
+    #   power of a prime only multiplies the divisors added by the previous power.
+    divs = [1]
+    added = []
+    previous = None
+    for p in prime_factors(num):
+        if p != previous:
+            added = divs
+        added = [d * p for d in added]
+        divs += added
+        previous = p
+    return sorted(divs)[:-1]
+
+
+def number_of_divisors(num):
+    """ Returns how many integers divide this number, including 1 but not including this number """
+    if num < len(divisor_counts):
+        return divisor_counts[num]
+    return len(divisors(num))
 
 
 def sum_of_divisors(num):
     """ Returns the sum of all integers that divide this number, including 1 but not including this number """
+    if num < len(divisor_sums):
+        return divisor_sums[num]
     return sum(divisors(num))
 
 
+def _extend_fibonacci_numbers(num):
+    """ Extends the Fibonacci sequence (and its set) until it reaches at least the given number. """
+    while num > fibonacci_numbers[-1]:
+        fibonacci_numbers.append(fibonacci_numbers[-1] + fibonacci_numbers[-2])
+        fibonacci_set.add(fibonacci_numbers[-1])
+
+
 def is_fibonacci_number(num):
     """
     Returns True if the given number is in the Fibonacci sequence, False otherwise. Computes Fibonacci sequence
-    iteratively as needed.
+    iteratively as needed, and checks membership in a set of it rather than scanning the list.
     """
-    global fibonacci_numbers
-    while num > fibonacci_numbers[-1]:
-        fibonacci_numbers.append(fibonacci_numbers[-1] + fibonacci_numbers[-2])
-    return num in fibonacci_numbers
+    _extend_fibonacci_numbers(num)
+    return num in fibonacci_set
+
+
+def _sum_of_squared_digits(num, base):
+    """ Returns the sum of the squares of the digits in the base-base representation of the given number. """
+    total = 0
+    while num:
+        num, d = divmod(num, base)
+        total += d * d
+    return total
 
 
 def is_happy_number(num, base=10):
     """
     Returns True if the given number is a Happy Number in the given base, False otherwise.
     https://en.wikipedia.org/wiki/Happy_number
+    Every number visited along the way is remembered as happy or unhappy, so later chains in the same base stop as
+    soon as they reach a number that has already been seen.
+    """
+    known = happy_numbers.setdefault(base, {})
+    chain = {}  # dict rather than set, to keep the visiting order for the cache
+    while num not in known and num not in chain:
+        chain[num] = None
+        num = _sum_of_squared_digits(num, base)
+    happy = known[num] if num in known else num == 1
+    for n in chain:
+        known[n] = happy
+    return happy
+
+
+def happy_bases(num, bases=range(2, 17)):
+    """ Returns the sublist of the given bases, in order, in which the given number is a Happy Number. """
+    return [b for b in bases if is_happy_number(num, b)]
+
+
+# The properties next_beat_with() and beats_with() can answer, by name: each maps a number to whether it has it
+PROPERTIES = {
+    "prime": lambda num: is_prime(num),
+    "non_prime": lambda num: not is_prime(num),
+    "happy": lambda num: is_happy_number(num),
+    "fibonacci_divisor_sum": lambda num: is_fibonacci_number(sum_of_divisors(num)),
+}
+occurrences = {}  # property name -> (limit, ascending list of every number below limit that has the property)
+
+
+def index_property(name, limit):
+    """
+    Precomputes, for one of PROPERTIES, the ascending list of every number below the given limit that has it, so
+    that next_beat_with() and beats_with() become binary searches. Does nothing if the index is already that large.
+    :param name: A key of PROPERTIES
+    :param limit: One more than the largest number that will be queried
+    """
+    if name not in PROPERTIES:
+        raise ValueError("Unknown property {!r}; expected one of {}".format(name, ", ".join(PROPERTIES)))
+    if name in occurrences and limit <= occurrences[name][0]:
+        return
+    sieve(limit)
+    if name == "fibonacci_divisor_sum":
+        divisor_sieve(limit)
+    if name == "prime":
+        numbers = primes[:bisect_left(primes, limit)]
+    elif name == "fibonacci_divisor_sum":
+        numbers = np.flatnonzero(is_fibonacci_number_batch(divisor_sums[:limit])).tolist()
+    else:
+        has = PROPERTIES[name]
+        numbers = [num for num in range(limit) if has(num)]
+    occurrences[name] = (limit, numbers)
+
+
+def next_beat_with(name, num):
+    """
+    Returns the first number at or after the given one that has the named property (one of PROPERTIES), e.g.
+    next_beat_with("prime", 24) == 29. Grows the index as needed.
+    """
+    index_property(name, num + 1)
+    while True:
+        limit, numbers = occurrences[name]
+        i = bisect_left(numbers, num)
+        if i < len(numbers):
+            return numbers[i]
+        index_property(name, 2 * limit)
+
+
+def beats_with(name, lo, hi):
+    """
+    Returns the ascending list of numbers in [lo, hi) that have the named property (one of PROPERTIES), e.g.
+    beats_with("happy", 1, 20) == [1, 7, 10, 13, 19]. Grows the index as needed.
+    """
+    index_property(name, hi)
+    numbers = occurrences[name][1]
+    return numbers[bisect_left(numbers, lo):bisect_left(numbers, hi)]
+
+
+class DigitCounter:
+    """
+    Keeps the digits of a number in several bases at once, like a set of odometers, for walking through consecutive
+    numbers. Each call to advance() adds one with carry propagation, and the digit sum, digit tallies and palindrome
+    status of each base are updated only where digits changed, so most queries are amortized O(1) per base.
+    Advancing costs time in every base on every number, whether or not anything reads it, so compose() doesn't use
+    one; pass one to NumberProperties when most numbers walked through have their digits read in most bases.
+    """
+
+    def __init__(self, num=0, bases=range(2, 17)):
+        """
+        :param num: The number to start on
+        :param bases: The bases in which to keep the number's digits
+        """
+        self.num = num
+        self.bases = tuple(bases)
+        self._digits = {}        # base -> digits, least-significant first
+        self._sums = {}          # base -> sum of digits
+        self._tallies = {}       # base -> how many times each digit value occurs
+        self._mismatches = {}    # base -> how many mirrored digit pairs differ (0 if a palindrome)
+        for base in self.bases:
+            self._reset(base)
+
+    def _reset(self, base):
+        """ Recomputes everything kept for the given base from scratch. """
+        n = self.num
+        digits = [n % base]
+        while n >= base:
+            n //= base
+            digits.append(n % base)
+        tally = [0] * base
+        for d in digits:
+            tally[d] += 1
+        self._digits[base] = digits
+        self._sums[base] = sum(digits)
+        self._tallies[base] = tally
+        self._mismatches[base] = sum(digits[i] != digits[-1 - i] for i in range(len(digits) // 2))
+
+    def _set(self, base, position, value):
+        """ Changes a single digit in the given base, updating the sum, tally and palindrome status to match. """
+        digits = self._digits[base]
+        old = digits[position]
+        mirror = len(digits) - 1 - position
+        if mirror != position:
+            self._mismatches[base] += (value != digits[mirror]) - (old != digits[mirror])
+        self._tallies[base][old] -= 1
+        self._tallies[base][value] += 1
+        self._sums[base] += value - old
+        digits[position] = value
+
+    def advance(self):
+        """ Adds one to the number, carrying in every base. """
+        self.num += 1
+        for base in self.bases:
+            digits = self._digits[base]
+            if self._tallies[base][base - 1] == len(digits):
+                # every digit carries, so the number gains a digit; this happens only log(num) times per base
+                self._reset(base)
+                continue
+            position = 0
+            while digits[position] == base - 1:
+                self._set(base, position, 0)
+                position += 1
+            self._set(base, position, digits[position] + 1)
+        return self.num
+
+    def representation(self, base):
+        """ Returns the base-base representation of the number as a string, as _base() would. """
+        return "".join("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"[d] for d in reversed(self._digits[base]))
+
+    def ones_in_binary_repr(self):
+        """ Returns the number of ones in the number's binary representation """
+        return self._sums[2]
+
+    def digital_sum(self, base=10):
+        """ Returns the sum of the digits in the base-base representation of the number. """
+        return self._sums[base]
+
+    def digit_count(self, digit, base=10):
+        """ Returns how many times the given digit appears in the base-base representation of the number. """
+        return self._tallies[base][digit] if digit < base else 0
+
+    def highest_digit(self, base=10):
+        """ Returns the highest digit in the number, in the given base """
+        tally = self._tallies[base]
+        return next(d for d in range(base - 1, -1, -1) if tally[d])
+
+    def lowest_digit(self, base=10):
+        """ Returns the lowest digit in the number, in the given base """
+        tally = self._tallies[base]
+        return next(d for d in range(base) if tally[d])
+
+    def palindromes(self, bases=range(10, 1, -1)):
+        """ Returns the sublist of the given bases, in order, in which the number is a palindrome. """
+        return [b for b in bases if self._mismatches[b] == 0]
+
+
+class NumberProperties:
+    """
+    The properties of a single number (e.g. the current beat), computed lazily the first time something asks for
+    them and cached after that, so that several voices can read the same property without recomputing it.
+    Each method returns the heuristic of the same name for this number.
+    Hits, misses and time spent computing are tallied per property across all instances, in the class-level
+    counters `hits`, `misses` and `seconds`.
+    """
+    hits = Counter()
+    misses = Counter()
+    seconds = Counter()
+
+    def __init__(self, num, digits=None):
+        """
+        :param num: The number whose properties to compute
+        :param digits: Optionally, a DigitCounter currently on this number, to read digit properties from
+        """
+        self.num = num
+        self.digits = digits
+        self._cache = {}
+
+    def _cached(self, name, function, *args):
+        """
+        Returns function(*args) under the given property name, computing it only if it isn't cached yet.
+        Lists are copied on the way out, so that a caller mutating its result (e.g. popping from a list of
+        factors) can't change what other callers see.
+        """
+        key = (name,) + args
+        if key in self._cache:
+            NumberProperties.hits[name] += 1
+        else:
+            NumberProperties.misses[name] += 1
+            start = perf_counter()
+            self._cache[key] = function(*args)
+            NumberProperties.seconds[name] += perf_counter() - start
+        value = self._cache[key]
+        return list(value) if type(value) == list else value
+
+    def _counted(self, base):
+        """ Returns True if digit properties in the given base can be read from the DigitCounter. """
+        return self.digits is not None and base in self.digits.bases
+
+    @classmethod
+    def reset_stats(cls):
+        """ Clears the hit, miss and timing counters. """
+        cls.hits.clear()
+        cls.misses.clear()
+        cls.seconds.clear()
+
+    @classmethod
+    def stats_table(cls):
+        """ Returns the hit, miss and timing counters as a table, as a string, sorted by time spent. """
+        lines = ["{:<24}{:>10}{:>10}{:>12}".format("property", "hits", "misses", "seconds")]
+        for name in sorted(cls.misses, key=lambda n: cls.seconds[n], reverse=True):
+            lines.append("{:<24}{:>10}{:>10}{:>12.6f}".format(name, cls.hits[name], cls.misses[name],
+                                                              cls.seconds[name]))
+        return "\n".join(lines)
+
+    def is_prime(self):
+        return self._cached("is_prime", is_prime, self.num)
+
+    def prime_factors(self):
+        return self._cached("prime_factors", prime_factors, self.num)
+
+    def sum_of_prime_factors(self):
+        return self._cached("sum_of_prime_factors", sum_of_prime_factors, self.num)
+
+    def divisors(self):
+        return self._cached("divisors", divisors, self.num)
+
+    def number_of_divisors(self):
+        return self._cached("number_of_divisors", number_of_divisors, self.num)
+
+    def sum_of_divisors(self):
+        return self._cached("sum_of_divisors", sum_of_divisors, self.num)
+
+    def ones_in_binary_repr(self):
+        if self._counted(2):
+            return self._cached("ones_in_binary_repr", lambda n: self.digits.ones_in_binary_repr(), self.num)
+        return self._cached("ones_in_binary_repr", ones_in_binary_repr, self.num)
+
+    def digital_sum(self, base=10):
+        if self._counted(base):
+            return self._cached("digital_sum", lambda n, b: self.digits.digital_sum(b), self.num, base)
+        return self._cached("digital_sum", digital_sum, self.num, base)
+
+    def digital_root(self, base=10):
+        return self._cached("digital_root", digital_root, self.num, base)
+
+    def highest_digit(self, base=10):
+        if self._counted(base):
+            return self._cached("highest_digit", lambda n, b: self.digits.highest_digit(b), self.num, base)
+        return self._cached("highest_digit", highest_digit, self.num, base)
+
+    def lowest_digit(self, base=10):
+        if self._counted(base):
+            return self._cached("lowest_digit", lambda n, b: self.digits.lowest_digit(b), self.num, base)
+        return self._cached("lowest_digit", lowest_digit, self.num, base)
+
+    def last_nonzero_digit(self, base=10):
+        return self._cached("last_nonzero_digit", last_nonzero_digit, self.num, base)
+
+    def digit_count(self, digit, base=10):
+        if self._counted(base):
+            return self._cached("digit_count", lambda n, d, b: self.digits.digit_count(d, b), self.num, digit, base)
+        return self._cached("digit_count", lambda n, d, b: _base(n, b).count(_base(d, b)), self.num, digit, base)
+
+    def palindromes(self, bases=range(10, 1, -1)):
+        bases = tuple(bases)
+        if all(self._counted(b) for b in bases):
+            return self._cached("palindromes", lambda n, bs: self.digits.palindromes(bs), self.num, bases)
+        return self._cached("palindromes", palindromes, self.num, bases)
+
+    def is_happy_number(self, base=10):
+        return self._cached("is_happy_number", is_happy_number, self.num, base)
+
+    def happy_bases(self, bases=range(2, 17)):
+        return self._cached("happy_bases", happy_bases, self.num, tuple(bases))
+
+
+# Batch versions of the digit heuristics above. Each takes a sequence or array of non-negative integers (e.g. every
+#   beat in the piece) and returns a NumPy array with one entry per number, computed with a few vectorized passes
+#   instead of one string conversion per number. Given a sequence of bases rather than a single base, they return a
+#   2-D array instead, with one row per number and one column per base, in the order given (like palindromes_batch).
+
+def digit_matrix(nums, base=10):
+    """
+    Returns the digits of every given number in the given base, as a 2-D array with one row per number.
+    Digits are stored least-significant first (column k holds the digit for base**k), padded with zeros.
+    Given a sequence of bases, the digits array is 3-D instead, indexed [number, base, k], and padded to the width
+    of the smallest base; lengths is then 2-D, indexed [number, base].
+    :param nums: A sequence or array of non-negative integers
+    :param base: The base in which to take the digits, or a sequence of bases
+    :return: A tuple (digits, lengths), where lengths holds the number of digits of each number (at least 1)
+    """
+    nums = np.asarray(nums, dtype=np.int64)
+    bases = np.asarray(base, dtype=np.int64)
+    rest = (nums[:, None] if bases.ndim else nums) + np.zeros_like(bases)
+    width = len(_base(int(nums.max()), int(bases.min()))) if nums.size and bases.size else 1
+    digits = np.empty(rest.shape + (width,), dtype=np.int64)
+    zero = rest == 0
+    for k in range(width):
+        digits[..., k] = rest % bases
+        rest //= bases
+    lengths = np.maximum(width - np.argmax(digits[..., ::-1] != 0, axis=-1), 1)
+    lengths[zero] = 1
+    return digits, lengths
+
+
+def ones_in_binary_repr_batch(nums):
+    """ Returns the number of ones in the binary representation of each given number """
+    return digit_matrix(nums, 2)[0].sum(axis=-1)
+
+
+def digital_sum_batch(nums, base=10):
+    """ Returns the sum of the digits in the base-base representation of each given number """
+    return digit_matrix(nums, base)[0].sum(axis=-1)
+
+
+def digital_root_batch(nums, base=10):
+    """ Returns the digital root of the base-base representation of each given number """
+    nums = np.asarray(nums, dtype=np.int64)
+    base = np.asarray(base, dtype=np.int64)
+    if base.ndim:
+        nums = nums[:, None]
+    return np.where(nums == 0, 0, 1 + (nums - 1) % (base - 1))
+
+
+def highest_digit_batch(nums, base=10):
+    """ Returns the highest digit of each given number, in the given base """
+    return digit_matrix(nums, base)[0].max(axis=-1)
+
+
+def lowest_digit_batch(nums, base=10):
+    """ Returns the lowest digit of each given number, in the given base """
+    digits, lengths = digit_matrix(nums, base)
+    padding = np.arange(digits.shape[-1]) >= lengths[..., None]
+    return np.where(padding, np.asarray(base)[..., None], digits).min(axis=-1)
+
+
+def last_nonzero_digit_batch(nums, base=10):
+    """ Returns the last nonzero digit of each given number, or 0 for 0, in the given base """
+    digits = digit_matrix(nums, base)[0]
+    return np.take_along_axis(digits, np.argmax(digits != 0, axis=-1)[..., None], axis=-1)[..., 0]
+
+
+def is_fibonacci_number_batch(nums):
+    """ Returns a boolean array: whether each given number is in the Fibonacci sequence """
+    nums = np.asarray(nums, dtype=np.int64)
+    largest = int(nums.max()) if nums.size else 0
+    _extend_fibonacci_numbers(largest)
+    return np.isin(nums, np.array(fibonacci_numbers[:bisect_right(fibonacci_numbers, largest)], dtype=np.int64))
+
+
+def palindromes_batch(nums, bases=range(10, 1, -1)):
+    """
+    Checks if each given number is a palindrome in every given base.
+    Returns a boolean array with one row per number and one column per base, in the order given, so that
+    bases[j] is in palindromes(nums[i], bases) exactly when the result at [i, j] is True.
     """
-    visited = []
-    while num not in visited:
-        visited.append(num)
-        num = sum(int(i, base)**2 for i in _base(num, base))
-    return num == 1
+    digits, lengths = digit_matrix(nums, list(bases))
+    mirror = lengths[..., None] - 1 - np.arange(digits.shape[-1])
+    reflected = np.take_along_axis(digits, np.maximum(mirror, 0), axis=-1)
+    return np.all((reflected == digits) | (mirror < 0), axis=-1)
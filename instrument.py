@@ -3,70 +3,54 @@ file: instrument.py
 author: Louis Jacobowitz (ljacobo@ncsu.edu)
 """
 
+import heapq
 import re
 
 HALF_STEPS_IN_OCTAVE = 12
 
 class Pitch:
     """
-    Represents a cSound pitch class, decomposed into octave and note
+    Represents a cSound pitch class, decomposed into octave and note.
+    Stored as a single absolute number of half-steps (octave * 12 + note). Pitches are immutable and interned:
+    there is only ever one Pitch for each number of half-steps, so adding an int to a Pitch is a lookup rather
+    than a new object, and its "octave.note" string is formatted once.
     """
+    __slots__ = ('semitone',)
 
-    def __init__(self, pitch_class):
+    def __new__(cls, pitch_class):
         """
-        Constructs a pitch object from a given pitch string or tuple
+        Returns the pitch object for a given pitch string, tuple or number of half-steps
         :param pitch_class: A string (e.g. '8.01'), representing octave and number of half-steps,
-                            or a tuple (octave, halfsteps), e.g. (8, 1).
+                            or a tuple (octave, halfsteps), e.g. (8, 1),
+                            or an int, the absolute number of half-steps (octave * 12 + halfsteps), e.g. 97.
         """
+        if type(pitch_class) == int:
+            return _pitch(pitch_class)
         if type(pitch_class) == str:
-            if not re.fullmatch(r'\d+.\d+', pitch_class):
-                raise ValueError('Pitch class must be a string in the form "octave.note", e.g. "8.01"')
-            self.octave, self.note = (int(i) for i in pitch_class.split('.'))
-        elif type(pitch_class) == tuple and len(pitch_class) == 2:
-            self.octave, self.note = pitch_class
-        else:
-            raise ValueError("Pitch class must be a string or a 2-tuple")
-        self.resolve()
+            if pitch_class not in _parsed_pitches:
+                if not re.fullmatch(r'\d+.\d+', pitch_class):
+                    raise ValueError('Pitch class must be a string in the form "octave.note", e.g. "8.01"')
+                octave, note = (int(i) for i in pitch_class.split('.'))
+                _parsed_pitches[pitch_class] = octave * HALF_STEPS_IN_OCTAVE + note
+            return _pitch(_parsed_pitches[pitch_class])
+        if type(pitch_class) == tuple and len(pitch_class) == 2:
+            octave, note = pitch_class
+            return _pitch(octave * HALF_STEPS_IN_OCTAVE + note)
+        raise ValueError("Pitch class must be a string, a 2-tuple or an int")
 
-    def resolve(self):
-        """
-        Changes the octave according to the note, if the note is greater than or equal to 12 or less than 0.
-        Then, mods the note to be within that range.
-        """
-        self.octave += self.note // HALF_STEPS_IN_OCTAVE
-        self.note %= HALF_STEPS_IN_OCTAVE
+    @property
+    def octave(self):
+        return self.semitone // HALF_STEPS_IN_OCTAVE
 
-    def __iadd__(self, other):
-        """
-        If argument is a Pitch, adds octaves together and notes together.
-        If argument is an int, adds that many half-steps.
-        Throws a ValueError otherwise.
-        """
-        if type(other) not in (Pitch, int):
-            raise ValueError('Cannot add Pitch to non-Pitch/non-Int value')
-        if type(other) == Pitch:
-            self.octave += other.octave
-            self.note += other.note
-        else:
-            self.note += other
-        self.resolve()
-        return self
+    @property
+    def note(self):
+        return self.semitone % HALF_STEPS_IN_OCTAVE
 
-    def __isub__(self, other):
-        """
-        If argument is a Pitch, subtracts the number of octaves and notes.
-        If argument is an int, subtracts that many notes.
-        Throws a ValueError otherwise.
-        """
-        if type(other) not in (Pitch, int):
-            raise ValueError('Cannot add Pitch to non-Pitch/non-Int value')
-        if type(other) == Pitch:
-            self.octave -= other.octave
-            self.note -= other.note
-        else:
-            self.note -= other
-        self.resolve()
-        return self
+    def __setattr__(self, name, value):
+        raise AttributeError("Pitch is immutable; add to it to get another Pitch")
+
+    def __reduce__(self):
+        return Pitch, (self.semitone,)
 
     def __add__(self, other):
         """
@@ -74,15 +58,11 @@ class Pitch:
         If argument is an int, adds that many half-steps.
         Throws a ValueError otherwise.
         """
-        if type(other) not in (Pitch, int):
-            raise ValueError('Cannot add Pitch to non-Pitch/non-Int value')
+        if type(other) == int:
+            return _pitch(self.semitone + other)
         if type(other) == Pitch:
-            new_oct = self.octave + other.octave
-            new_note = self.note + other.note
-        else:
-            new_oct = self.octave
-            new_note = self.note + other
-        return Pitch((new_oct, new_note))
+            return _pitch(self.semitone + other.semitone)
+        raise ValueError('Cannot add Pitch to non-Pitch/non-Int value')
 
     def __sub__(self, other):
         """
@@ -90,15 +70,11 @@ class Pitch:
             If argument is an int, subtracts that many notes.
             Throws a ValueError otherwise.
         """
-        if type(other) not in (Pitch, int):
-            raise ValueError('Cannot add Pitch to non-Pitch/non-Int value')
+        if type(other) == int:
+            return _pitch(self.semitone - other)
         if type(other) == Pitch:
-            new_oct = self.octave - other.octave
-            new_note = self.note - other.note
-        else:
-            new_oct = self.octave
-            new_note = self.note - other
-        return Pitch((new_oct, new_note))
+            return _pitch(self.semitone - other.semitone)
+        raise ValueError('Cannot add Pitch to non-Pitch/non-Int value')
 
     def __radd__(self, other):
         return self.__add__(other)
@@ -106,16 +82,123 @@ class Pitch:
     def __rsub__(self, other):
         return self.__sub__(other)
 
+    def __float__(self):
+        """ Returns the pitch as a number in cSound's pch format, e.g. 8.02 """
+        return self.octave + self.note / 100
+
     def __str__(self):
         """
         Returns a string representation of the pitch in the format "8.02", with non-padded octave
         and two-character zero-padded note
         """
-        return "{:d}.{:02d}".format(self.octave, self.note)
+        return _pitch_strings[self.semitone]
+
+    def __repr__(self):
+        return "Pitch({!r})".format(str(self))
+
+
+_pitches = {}          # number of half-steps -> the one Pitch for it
+_pitch_strings = {}    # number of half-steps -> its "octave.note" string
+_parsed_pitches = {}   # every "octave.note" string given to Pitch() so far -> its number of half-steps
+
+
+def _pitch(semitone):
+    """ Returns the interned Pitch for the given absolute number of half-steps, creating it the first time. """
+    try:
+        return _pitches[semitone]
+    except KeyError:
+        pitch = object.__new__(Pitch)
+        object.__setattr__(pitch, 'semitone', semitone)
+        _pitch_strings[semitone] = "{:d}.{:02d}".format(*divmod(semitone, HALF_STEPS_IN_OCTAVE))
+        _pitches[semitone] = pitch
+        return pitch
+
+
+# every pitch from octave 0 through 15, which covers anything cSound's pch format is used for in practice
+for _semitone in range(16 * HALF_STEPS_IN_OCTAVE):
+    _pitch(_semitone)
+
+
+def _resolve(value):
+    """ Formats a lazily formatted (format, arg1, arg2, ...) tuple; returns any other value as-is. """
+    if type(value) == tuple:
+        return value[0].format(*value[1:])
+    return value
+
+
+class Note:
+    """
+    A single note in an Instrument's sequence, stored compactly as a tuple of p-field values shared with a
+    field-name index from the Instrument, rather than as a dict per note. Supports dict-style reads by field name.
+    A field value given as a tuple (format, arg1, arg2, ...) is a lazily formatted string, e.g. a comment:
+    it is only formatted when read.
+    """
+    __slots__ = ('index', 'values')
+
+    def __init__(self, index, values):
+        """
+        :param index: A dict from field name to position in values, shared by every note of the same Instrument
+        :param values: A tuple of this note's field values, in p-field order
+        """
+        self.index = index
+        self.values = values
+
+    def __getitem__(self, key):
+        return _resolve(self.values[self.index[key]])
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key, default=None):
+        return self[key] if key in self.index else default
+
+    def keys(self):
+        return self.index.keys()
+
+    def line(self, **overrides):
+        """
+        Returns this note as a line of a cSound score (without a newline), with tab-separated fields in p-field
+        order. Any field given as a keyword argument is written with that value instead of its own.
+        """
+        values = self.values
+        if overrides:
+            values = list(values)
+            for key, value in overrides.items():
+                values[self.index[key]] = value
+        return "\t".join([str(_resolve(value)) for value in values])
+
+    def replace(self, **fields):
+        """ Returns a copy of this note with the given fields changed. """
+        values = list(self.values)
+        for key, value in fields.items():
+            values[self.index[key]] = value
+        return Note(self.index, tuple(values))
+
+    def pfields(self):
+        """
+        Returns this note's p-fields as a list of numbers, in p-field order, for sending straight to cSound:
+        the instrument (e.g. "i4") becomes its number, pitches become pch numbers, and the comment is left out.
+        """
+        fields = []
+        for key, value in zip(self.index, self.values):
+            if key == "comment":
+                continue
+            if key == "instrument":
+                value = value.lstrip("i")
+            fields.append(float(value))
+        return fields
+
+    def as_dict(self):
+        """ Returns this note as a dict from field name to (formatted) value. """
+        return {key: self[key] for key in self.index}
 
 
 class Instrument:
-    def __init__(self, mapping, short="i1", long="i1", default_pitch="8.00", default_amplitude=86, **kwargs):
+    # Fields every note has, filled from add_note()'s own arguments rather than from kwargs
+    CORE_FIELDS = ("instrument", "start", "duration", "amplitude", "pitch")
+
+    def __init__(self, mapping, short="i1", long="i1", default_pitch="8.00", default_amplitude=86,
+                 keep_comments=True, **kwargs):
         """
         Initializes an instrument.
         :param mapping: A dict with keys corresponding to variable names, and values corresponding to p-variables
@@ -124,6 +207,7 @@ class Instrument:
         :param long: (str) The instrument in the orchestra to refer to for long notes (>1 beat)
         :param default_pitch: The default pitch class for this instrument, added to/subtracted from
         :param default_amplitude: The default amplitude for this instrument in decibels, to be added to/subtracted from
+        :param keep_comments: If False, comments passed to add_note() are dropped in favor of the default comment
         :param kwargs: Other named fields that map to p-variables through mapping, and their default values.
         """
         self.mapping = mapping
@@ -131,9 +215,28 @@ class Instrument:
         self.long_instrument = long
         self.default_pitch = Pitch(default_pitch)
         self.default_amplitude = default_amplitude
+        self.keep_comments = keep_comments
         self.default_kwargs = kwargs
         self.note_sequence = []
         self.dormant_until = 0
+        # field names in p-field order, and each one's position in a Note's values
+        self.fields = tuple(sorted(mapping, key=lambda key: mapping[key]))
+        self.field_index = {key: i for i, key in enumerate(self.fields)}
+        self._layout = tuple((key, self.CORE_FIELDS.index(key) if key in self.CORE_FIELDS else None)
+                             for key in self.fields)
+
+    def _field_value(self, key, kwargs):
+        """ Returns the value of a non-core field for a new note, given the kwargs passed to add_note(). """
+        if key not in kwargs or (key == "comment" and not self.keep_comments):
+            return self.default_kwargs.get(key, 0)
+        value = kwargs[key]
+        if key not in self.default_kwargs:
+            return value
+        default = self.default_kwargs[key]
+        if type(value) == tuple:
+            # a lazily formatted string; prepend the default to its format, if there is one
+            return (default + value[0],) + value[1:] if default else value
+        return default + value
 
     def add_note(self, start, length=1.0, pitch=None, amplitude=None, ignore_dormant=False, **kwargs):
         """
@@ -146,42 +249,124 @@ class Instrument:
         :param pitch: The pitch adjustment of this note relative to the default for this instrument (as an int)
         :param amplitude: The amplitude adjustment of this note relative to default (as an int, in decibels)
         :param kwargs: Other named fields mapping to p-variables, changed relative to default values.
+                       A string field (e.g. comment) may be given as a tuple (format, arg1, arg2, ...) to be
+                       formatted only when the score is written.
         """
         if not ignore_dormant and start < self.dormant_until:
             return
-        note = {
-            "instrument": self.short_instrument if length <= 1 else self.long_instrument,
-            "start": start,
-            "duration": length,
-            "amplitude": (self.default_amplitude + amplitude) if type(amplitude) == int else self.default_amplitude,
-            "pitch": (self.default_pitch + pitch) if type(pitch) == int else self.default_pitch,
-        }
-        for key in self.mapping.keys():
-            if key in note:
-                # then we already covered it and have no need to do so again
-                continue
-            if key in kwargs and key in self.default_kwargs:
-                note[key] = self.default_kwargs[key] + kwargs[key]
-            elif key in kwargs:
-                note[key] = kwargs[key]
-            elif key in self.default_kwargs:
-                note[key] = self.default_kwargs[key]
-            else:
-                note[key] = 0
-        self.note_sequence.append(note)
+        core = (
+            self.short_instrument if length <= 1 else self.long_instrument,
+            start,
+            length,
+            (self.default_amplitude + amplitude) if type(amplitude) == int else self.default_amplitude,
+            (self.default_pitch + pitch) if type(pitch) == int else self.default_pitch,
+        )
+        values = tuple(core[i] if i is not None else self._field_value(key, kwargs) for key, i in self._layout)
+        self.note_sequence.append(Note(self.field_index, values))
         self.dormant_until = start + length
 
+    def iter_lines(self):
+        """
+        Yields, one line at a time (without newlines), a cSound score table for each note this instrument plays
+        throughout the piece, in order, according to the mapping given upon construction.
+        Arguments in each line are tab-separated.
+        """
+        for note in self.note_sequence:
+            yield note.line()
+
+    def write_note_sequence(self, out):
+        """
+        Writes the lines from iter_lines() to the given file-like object, each followed by a newline, without
+        building the whole table in memory.
+        """
+        for line in self.iter_lines():
+            out.write(line)
+            out.write("\n")
+
     def output_note_sequence(self):
         """
         Returns, as a string, a cSound score table for each note this instrument plays throughout the piece,
         in order, without headings, according to the mapping given upon construction.
         Arguments in each line are tab-separated.
         """
-        output = []
-        for note in self.note_sequence:
-            mapping = sorted(list(self.mapping.items()), key=lambda x: x[1])
-            args = [str(note[x[0]]) for x in mapping]
-            output.append("\t".join(args))
-        return "\n".join(output)
-        # return "\n".join("\t".join(str(note[x[0]]) for x in sorted(list(self.mapping.items()), key=lambda i:i[1])) for note in self.note_sequence)
+        return "\n".join(self.iter_lines())
+
+
+def iter_merged_notes(instruments):
+    """
+    Yields the notes of all the given instruments as a single stream, sorted by start time. Instruments whose
+    notes were added in order of start time (as compose() does) are merged lazily; any other is sorted first.
+    Notes starting at the same time keep the order of the given instruments.
+    :param instruments: An iterable of Instruments
+    """
+    def keyed(instr):
+        notes = instr.note_sequence
+        if any(notes[i]["start"] > notes[i + 1]["start"] for i in range(len(notes) - 1)):
+            notes = sorted(notes, key=lambda note: note["start"])
+        for note in notes:
+            yield note["start"], note
+    for start, note in heapq.merge(*(keyed(instr) for instr in instruments), key=lambda pair: pair[0]):
+        yield note
+
+
+def iter_merged_lines(instruments):
+    """ Yields the score lines of all the given instruments as a single stream, sorted by start time. """
+    for note in iter_merged_notes(instruments):
+        yield note.line()
 
+
+def iter_compact_lines(notes):
+    """
+    Yields score lines for the given notes, in the order given, leaving out what cSound doesn't need:
+      - notes with a duration of 0, which cSound initializes but never performs, are dropped;
+      - a field with the same value as in the line before is written as a carry ("."), and a start time equal to
+        the previous line's start plus its duration is written as "+".
+    Carries are only used between consecutive lines for the same cSound instrument, as cSound requires, and never
+    for the instrument or the comment. The lines describe exactly the same performance as those of note.line().
+    :param notes: An iterable of Notes, e.g. from iter_merged_notes()
+    """
+    previous = None
+    for note in notes:
+        if note["duration"] == 0:
+            continue
+        fields = [str(_resolve(value)) for value in note.values]
+        if previous is None or previous[0] != fields[0]:
+            previous = fields
+            yield "\t".join(fields)
+            continue
+        line = [fields[0]]
+        for key, field, before in zip(list(note.index)[1:], fields[1:], previous[1:]):
+            if key == "comment":
+                line.append(field)
+            elif key == "start" and float(field) == float(before) + float(previous[note.index["duration"]]):
+                line.append("+")
+            elif key != "start" and field == before:
+                line.append(".")
+            else:
+                line.append(field)
+        previous = fields
+        yield "\t".join(line)
+
+
+def write_score(out, header, instruments, merge=False, compact=False):
+    """
+    Writes a whole cSound score to the given file-like object, one line at a time.
+    :param out: A file-like object with a write() method
+    :param header: The score's header (f-tables, tempo, etc.), written first, as-is
+    :param instruments: An iterable of Instruments whose notes to write
+    :param merge: If True, writes all instruments' notes as one stream sorted by start time; otherwise writes each
+                  instrument's notes in turn
+    :param compact: If True, writes the lines from iter_compact_lines(): the same performance, in less text
+    """
+    out.write(header)
+    if compact:
+        notes = iter_merged_notes(instruments) if merge else (note for instr in instruments
+                                                              for note in instr.note_sequence)
+        lines = iter_compact_lines(notes)
+    elif merge:
+        lines = iter_merged_lines(instruments)
+    else:
+        lines = (line for instr in instruments for line in instr.iter_lines())
+    for line in lines:
+        out.write(line)
+        out.write("\n")
@@ -2,32 +2,52 @@
 file: main.py
 author: Louis Jacobowitz (ljacobo@ncsu.edu)
 """
-import ctcsound
-from instrument import Instrument, Pitch
+import argparse
+import analysis
+import inspect
+import io
+import os
+from instrument import Instrument, Pitch, write_score
+from voice import Voice, Scheduler
 import heuristics
-import sys
+from profiler import Profiler
+import render
+import score_cache
+from time import perf_counter
 
 
-def init_score():
-    """
-    Returns the header of the cSound score, to be added to by actual instruments, as a string.
-    """
-    return """
-; Frequency generators
-f1	0	4096	10	1	                                       ; Sine wave
-f2  0   4096    10  1 0.5 0.3 0.25 0.2 0.167 0.14 0.125 .111   ; Sawtooth wave
-f3  0   4096    10  1 0   0.3 0    0.2 0     0.14 0     .111   ; Square wave
-f4  0   4096    10  1 1   1   1    0.7 0.5   0.3  0.1          ; Pulse wave
-f5  0   4096    9   1 1   0                                    ; for ACCCI Drumbell
-f12 0    256     1  "samples/marmstk1.wav" 0 0 0               ; for Marimba
+TEMPO = 217  # beats per minute
+FIRST_BEAT = 3  # the number the piece starts counting from
 
 
-; Envelopes
-f51 0   513     5   256   512  1
+def init_tables():
+    """
+    Returns the function tables used by the orchestra (hardcoded), as a list of tuples
+    (table number, size, GEN routine number, list of GEN arguments, comment).
+    """
+    return [
+        # Frequency generators
+        (1, 4096, 10, [1], "Sine wave"),
+        (2, 4096, 10, [1, 0.5, 0.3, 0.25, 0.2, 0.167, 0.14, 0.125, .111], "Sawtooth wave"),
+        (3, 4096, 10, [1, 0, 0.3, 0, 0.2, 0, 0.14, 0, .111], "Square wave"),
+        (4, 4096, 10, [1, 1, 1, 1, 0.7, 0.5, 0.3, 0.1], "Pulse wave"),
+        (5, 4096, 9, [1, 1, 0], "for ACCCI Drumbell"),
+        (12, 256, 1, ['"samples/marmstk1.wav"', 0, 0, 0], "for Marimba"),
+        # Envelopes
+        (51, 513, 5, [256, 512, 1], "Envelope"),
+    ]
 
-t   0   217                                         ; tempo: 217 BPM
 
-"""
+def init_score():
+    """
+    Returns the header of the cSound score, to be added to by actual instruments, as a string.
+    """
+    lines = [""]
+    for number, size, gen, args, comment in init_tables():
+        fields = ["f{}".format(number), 0, size, gen] + args
+        lines.append("{:<60}; {}".format(" ".join(str(f) for f in fields), comment))
+    lines += ["", "{:<60}; tempo: {} BPM".format("t 0 {}".format(TEMPO), TEMPO), "", ""]
+    return "\n".join(lines)
 
 
 def init_instruments():
@@ -198,277 +218,404 @@ def init_instruments():
     }
 
 
-def compose(instrs, beat_length):
+class Bass(Voice):
+    """ bassline: plays constantly, ascending until a prime number is reached """
+
+    def __init__(self, instrument):
+        super().__init__(instrument)
+        self.pitch = 1
+
+    def step(self, beat, props):
+        if props.is_prime():
+            self.pitch = 1
+            bass_amp = 10
+        else:
+            self.pitch += 1
+            bass_amp = 0
+        self.instrument.add_note(
+            start=beat,
+            pitch=self.pitch,
+            amplitude=bass_amp,
+            comment=("; bass_pitch = {}", self.pitch),
+        )
+
+
+class Quick(Voice):
     """
-    Runs a "main loop", counting up to beat_length, adding notes for various instruments
-    along the way.
-    :param instrs: A dict of Instruments, where key is name/role. Hard-coded.
-    :param beat_length: How many beats to continue for
+    quick: plays doubled staccato notes.
+      Pitch depends on the digital root of (the beat minus the sum of its divisors).
+      When it hits a fibonacci number, pauses for up to 9 beats depending
+      on the number's base-10 digital root.
     """
-    bass_pitch = 1
+    intervals = ((21, 797),)
 
-    high_count = 0
+    def __init__(self, instrument):
+        super().__init__(instrument)
+        self.cooldown = 0
 
-    quick_cooldown = 0
+    def step(self, beat, props):
+        if self.cooldown > 0:
+            self.cooldown -= 1
+        elif heuristics.is_fibonacci_number(props.sum_of_divisors()):
+            self.cooldown = props.digital_root()
+        else:
+            hsopf = props.sum_of_prime_factors()
+            quick_pitch = heuristics.digital_root(beat - hsopf)
+            self.instrument.add_note(
+                start=beat,
+                length=0.5,
+                pitch=quick_pitch,
+                comment=("; root({} - {} = {}) = {}", beat, hsopf, beat - hsopf, quick_pitch)
+            )
+            self.instrument.add_note(
+                start=beat + 0.5,
+                length=0.5,
+                pitch=quick_pitch,
+                comment='; "  "  "  "  " '
+            )
+
+
+class Long(Voice):
+    """
+    long: plays long tones. The length of each long tone is twice the number of bases 16 or less in which the
+       beat number is a palindrome, or for which it is not a palindrome, whichever is higher. The pitch
+       corresponds to the lower of the same.
+       Then, this instrument pauses for a number of beats corresponding to the number of '2's in
+       the beat number's base-3 representation.
+    """
+    intervals = ((45, 720),)
+
+    def __init__(self, instrument):
+        super().__init__(instrument)
+        self.cooldown = 0
+
+    def step(self, beat, props):
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return
+        palin_bases = props.palindromes(range(16, 1, -1))
+        palin = len(palin_bases)
+        nonpalin = 15 - palin
+        long_length, long_pitch = (2 * palin, nonpalin) if palin > nonpalin else (2 * nonpalin, palin)
+        self.cooldown = long_length + props.digit_count(2, 3)
+        self.instrument.add_note(
+            start=beat,
+            length=long_length,
+            pitch=-4,
+            ignore_dormant=True,
+        )
+        self.instrument.add_note(
+            start=beat,
+            length=long_length,
+            pitch=long_pitch,
+            amplitude=-5,
+            ignore_dormant=True,
+            comment=("; {} is a palindrome in {} bases: {}", beat, palin, palin_bases),
+        )
 
-    long_cooldown = 0
 
-    arpeggio = []
-    arpeggio_pitch = 0
-    arpeggio_cooldown = 0
+class High(Voice):
+    """
+    high note: plays chords depending on the number of ones in the number's binary representation,
+      then rests for a number of beats determined by the number's digital sum.
+      Further into the piece, rests for less time.
+    """
+    intervals = ((160, 766),)
+
+    def __init__(self, instrument):
+        super().__init__(instrument)
+        self.count = 0
+
+    def step(self, beat, props):
+        if self.count > 0:
+            self.count -= 1
+            return
+        high_pitch = 0
+        overtone_add = [4, 3, 5]
+        for i in range(props.ones_in_binary_repr()):
+            self.instrument.add_note(
+                start=beat,
+                duration=3,
+                pitch=high_pitch,
+                ignore_dormant=True,
+                comment=("; overtone {}", i)
+            )
+            high_pitch += overtone_add[i % 3]
+        self.count = props.digital_sum()
+        if beat > 400:
+            self.count //= 2
+
+
+class Arpeggio(Voice):
+    """
+    arpeggio: Plays beat-by-beat arpeggios according to the prime factors of the given number.
+      Skips any prime numbers it encounters, and doesn't start another arpeggio until a beat after it
+      is finished with one.
+    """
+    intervals = ((222, 737),)
+
+    def __init__(self, instrument):
+        super().__init__(instrument)
+        self.factors = []
+        self.pitch = 0
+        self.cooldown = 0
+
+    def step(self, beat, props):
+        if self.cooldown > 0:
+            self.cooldown -= 1
+        elif len(self.factors) == 0 and not props.is_prime():
+            self.pitch = 0
+            self.factors = props.prime_factors()
+            # these comments are formatted right away rather than lazily, since self.factors keeps changing
+            self.instrument.add_note(
+                start=beat,
+                comment="; Start of arpeggio: {} --> {}".format(beat, self.factors)
+            )
+        elif self.factors:
+            self.pitch += (self.factors.pop(0) % 12) or 12
+            self.instrument.add_note(
+                start=beat,
+                pitch=self.pitch,
+                comment="; {}".format(self.factors)
+            )
+            if len(self.factors) == 0:
+                self.cooldown = 1
+
+
+class Ascent(Voice):
+    """
+    ascent: Plays a note each time the highest digit of the note (in base 12) increases.
+      Pitch is relative to the highest digit in base 12; length is relative to how long that remains
+      the highest digit.
+    """
+    intervals = ((348, 433), (510, 577), (600, 721))
 
-    ascent_max = 0
-    ascent_length = 1
+    def __init__(self, instrument):
+        super().__init__(instrument)
+        self.max = 0
+        self.length = 1
 
-    buzzy_cooldown = 0
+    def step(self, beat, props):
+        digit_max = props.highest_digit(12)
+        if digit_max == self.max:
+            self.length += 1
+        else:
+            self.instrument.add_note(
+                start=beat - self.length,
+                length=self.length,
+                pitch=self.max,
+                amplitude=digit_max / 4,
+                comment=("; Beat {} --> {}, length={}", beat-1, heuristics._base(beat-1, 12), self.length)
+            )
+            self.length = 1
+            self.max = digit_max
+
+
+class Erratic(Voice):
+    """
+    erratic: Plays continuously. If the beat is divisible by its last nonzero digit, plays the tonic.
+      If not, and the number of ones is even, plays the fourth. Otherwise, plays the fifth.
+    """
+    intervals = ((252, 330), (413, 510), (580, 700))
+
+    def step(self, beat, props):
+        amplitude = (500 - beat) if beat in range(500, 510) else (690 - beat) if beat in range(690, 700) else 0,
+        if beat % props.last_nonzero_digit() == 0:
+            self.instrument.add_note(
+                start=beat,
+                amplitude=amplitude,
+                comment=("; Beat {} % {} = 0", beat, props.last_nonzero_digit())
+            )
+        else:
+            self.instrument.add_note(
+                start=beat,
+                pitch=5 if props.ones_in_binary_repr() % 2 == 0 else 7,
+                amplitude=amplitude,
+                comment=("; Beat {} % {} = {} --> {} has {} ones", beat,
+                                                                   props.last_nonzero_digit(),
+                                                                   beat % props.last_nonzero_digit(),
+                                                                   bin(beat),
+                                                                   props.ones_in_binary_repr())
+            )
+
+
+class Buzzy(Voice):
+    """
+    buzzy: plays based on the digital root of the number's cube.
+      When the number is divisible by its digital root (and not divisible by 3 or 9), pauses for a
+      number of beats dependent on difference between highest and lowest digit in base 10
+    """
+    intervals = ((116, 330), (376, 475), (550, 768))
+
+    def __init__(self, instrument):
+        super().__init__(instrument)
+        self.cooldown = 0
+
+    def step(self, beat, props):
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return
+        beat_n = beat**3
+        base_n = 11
+        pitch_n = heuristics.digital_root(beat_n, base_n)
+        self.instrument.add_note(
+            start=beat,
+            pitch=pitch_n,
+            comment=("; {}^3 = {}, digital root {}", beat, beat_n, pitch_n)
+        )
+        if beat % props.digital_root() == 0 and beat % 3 != 0:
+            self.cooldown = props.highest_digit() - props.lowest_digit()
 
-    happy_play = -1
 
-    for beat in range(3, beat_length):
-        # bassline: plays constantly, ascending until a prime number is reached
-        if heuristics.is_prime(beat):
-            bass_pitch = 1
-            bass_amp = 10
-        else:
-            bass_pitch += 1
-            bass_amp = 0
-        instrs['bass'].add_note(
+class Churchbell(Voice):
+    """
+    churchbell: plays inconsistently, randomly, when the number of ones in the number's binary representation
+      is also one of the number's divisors. Pitch is decided simply by the lowest digit in the number. Length
+      is determined by the number of divisors, multiplied until it's greater than 8; then that is multiplied by 2
+    """
+    intervals = ((270, 660),)
+
+    def step(self, beat, props):
+        if props.ones_in_binary_repr() not in props.divisors():
+            return
+        churchbell_amp = 15 * (beat / 660)
+        churchbell_length = props.number_of_divisors()
+        while churchbell_length <= 8:
+            churchbell_length += props.number_of_divisors()
+        # churchbell_length *= 2
+        self.instrument.add_note(
             start=beat,
-            pitch=bass_pitch,
-            amplitude=bass_amp,
-            comment="; bass_pitch = {}".format(bass_pitch),
+            pitch=props.lowest_digit(),
+            amplitude=churchbell_amp,
+            length=churchbell_length,
+            comment=("; n1s={}, divisors={}, pitch={}, length={}", props.ones_in_binary_repr(),
+                                                                   props.divisors(),
+                                                                   props.lowest_digit(),
+                                                                   churchbell_length)
         )
 
-        # quick: plays doubled staccato notes.
-        #   Pitch depends on the digital root of (the beat minus the sum of its divisors).
-        #   When it hits a fibonacci number, pauses for up to 9 beats depending
-        #   on the number's base-10 digital root.
-        if beat in range(21, 797):
-            if quick_cooldown > 0:
-                quick_cooldown -= 1
-            elif heuristics.is_fibonacci_number(heuristics.sum_of_divisors(beat)):
-                quick_cooldown = heuristics.digital_root(beat)
-            else:
-                hsopf = heuristics.sum_of_prime_factors(beat)
-                quick_pitch = heuristics.digital_root(beat - hsopf)
-                instrs['quick'].add_note(
-                    start=beat,
-                    length=0.5,
-                    pitch=quick_pitch,
-                    comment="; root({} - {} = {}) = {}".format(beat, hsopf, beat - hsopf, quick_pitch)
-                )
-                instrs['quick'].add_note(
-                    start=beat + 0.5,
-                    length=0.5,
-                    pitch=quick_pitch,
-                    comment='; "  "  "  "  " '
-                )
-
-        # long: plays long tones. The length of each long tone is twice the number of bases 16 or less in which the
-        #    beat number is a palindrome, or for which it is not a palindrome, whichever is higher. The pitch
-        #    corresponds to the lower of the same.
-        #    Then, this instrument pauses for a number of beats corresponding to the number of '2's in
-        #    the beat number's base-3 representation.
-        if beat in range(45, 720):
-            if long_cooldown > 0:
-                long_cooldown -= 1
-            else:
-                palin = len(heuristics.palindromes(beat, range(16, 1, -1)))
-                nonpalin = 15 - palin
-                long_length, long_pitch = (2 * palin, nonpalin) if palin > nonpalin else (2 * nonpalin, palin)
-                long_cooldown = long_length + heuristics._base(beat, 3).count('2')
-                instrs['long'].add_note(
-                    start=beat,
-                    length=long_length,
-                    pitch=-4,
-                    ignore_dormant=True,
-                )
-                instrs['long'].add_note(
-                    start=beat,
-                    length=long_length,
-                    pitch=long_pitch,
-                    amplitude=-5,
-                    ignore_dormant=True,
-                    comment="; {} is a palindrome in {} bases: {}".format(
-                        beat, palin, heuristics.palindromes(beat, range(16, 1, -1))),
-                )
-
-        # high note: plays chords depending on the number of ones in the number's binary representation,
-        #   then rests for a number of beats determined by the number's digital sum.
-        #   Further into the piece, rests for less time.
-        if beat in range(160, 766):
-            if high_count > 0:
-                high_count -= 1
-            else:
-                high_pitch = 0
-                overtone_add = [4, 3, 5]
-                for i in range(heuristics.ones_in_binary_repr(beat)):
-                    instrs['high'].add_note(
-                        start=beat,
-                        duration=3,
-                        pitch=high_pitch,
-                        ignore_dormant=True,
-                        comment="; overtone {}".format(i)
-                    )
-                    high_pitch += overtone_add[i % 3]
-                high_count = heuristics.digital_sum(beat)
-                if beat > 400:
-                    high_count //= 2
-
-        # arpeggio: Plays beat-by-beat arpeggios according to the prime factors of the given number.
-        #   Skips any prime numbers it encounters, and doesn't start another arpeggio until a beat after it
-        #   is finished with one.
-        if beat in range(222, 737):
-            if arpeggio_cooldown > 0:
-                arpeggio_cooldown -= 1
-            elif len(arpeggio) == 0 and not heuristics.is_prime(beat):
-                arpeggio_pitch = 0
-                arpeggio = heuristics.prime_factors(beat)
-                instrs['arpeggio'].add_note(
-                    start=beat,
-                    comment="; Start of arpeggio: {} --> {}".format(beat, arpeggio)
-                )
-            elif arpeggio:
-                arpeggio_pitch += (arpeggio.pop(0) % 12) or 12
-                instrs['arpeggio'].add_note(
-                    start=beat,
-                    pitch=arpeggio_pitch,
-                    comment="; {}".format(arpeggio)
-                )
-                if len(arpeggio) == 0:
-                    arpeggio_cooldown = 1
-
-        # ascent: Plays a note each time the highest digit of the note (in base 12) increases.
-        #   Pitch is relative to the highest digit in base 12; length is relative to how long that remains
-        #   the highest digit.
-        if beat in range(348, 433) or beat in range(510, 577) or beat in range(600, 721):
-            digit_max = heuristics.highest_digit(beat, 12)
-            if digit_max == ascent_max:
-                ascent_length += 1
-            else:
-                instrs['ascent'].add_note(
-                    start=beat - ascent_length,
-                    length=ascent_length,
-                    pitch=ascent_max,
-                    amplitude=digit_max / 4,
-                    comment="; Beat {} --> {}, length={}".format(beat-1, heuristics._base(beat-1, 12), ascent_length)
-                )
-                ascent_length = 1
-                ascent_max = digit_max
-
-        # erratic: Plays continuously. If the beat is divisible by its last nonzero digit, plays the tonic.
-        #   If not, and the number of ones is even, plays the fourth. Otherwise, plays the fifth.
-        if beat in range(252, 330) or beat in range(413, 510) or beat in range(580, 700):
-            amplitude = (500 - beat) if beat in range(500, 510) else (690 - beat) if beat in range(690, 700) else 0,
-            if beat % heuristics.last_nonzero_digit(beat) == 0:
-                instrs['erratic'].add_note(
-                    start=beat,
-                    amplitude=amplitude,
-                    comment="; Beat {} % {} = 0".format(beat, heuristics.last_nonzero_digit(beat))
-                )
-            else:
-                instrs['erratic'].add_note(
-                    start=beat,
-                    pitch=5 if heuristics.ones_in_binary_repr(beat) % 2 == 0 else 7,
-                    amplitude=amplitude,
-                    comment="; Beat {} % {} = {} --> {} has {} ones".format(beat,
-                                                                            heuristics.last_nonzero_digit(beat),
-                                                                            beat % heuristics.last_nonzero_digit(beat),
-                                                                            bin(beat),
-                                                                            heuristics.ones_in_binary_repr(beat))
-                )
-
-        # buzzy: plays based on the digital root of the number's cube.
-        #   When the number is divisible by its digital root (and not divisible by 3 or 9), pauses for a
-        #   number of beats dependent on difference between highest and lowest digit in base 10
-        if beat in range(116, 330) or beat in range(376, 475) or beat in range(550, 768):
-            if buzzy_cooldown > 0:
-                buzzy_cooldown -= 1
-            else:
-                beat_n = beat**3
-                base_n = 11
-                pitch_n = heuristics.digital_root(beat_n, base_n)
-                instrs['buzzy'].add_note(
-                    start=beat,
-                    pitch=pitch_n,
-                    comment="; {}^3 = {}, digital root {}".format(beat, beat_n, pitch_n)
-                )
-                if beat % heuristics.digital_root(beat) == 0 and beat % 3 != 0:
-                    buzzy_cooldown = heuristics.highest_digit(beat) - heuristics.lowest_digit(beat)
-
-        # churchbell: plays inconsistently, randomly, when the number of ones in the number's binary representation
-        #   is also one of the number's divisors. Pitch is decided simply by the lowest digit in the number. Length
-        #   is determined by the number of divisors, multiplied until it's greater than 8; then that is multiplied by 2
-        if beat in range(270, 660):
-            if heuristics.ones_in_binary_repr(beat) in heuristics.divisors(beat):
-                churchbell_amp = 15 * (beat / 660)
-                churchbell_length = len(heuristics.divisors(beat))
-                while churchbell_length <= 8:
-                    churchbell_length += len(heuristics.divisors(beat))
-                # churchbell_length *= 2
-                instrs['churchbell'].add_note(
-                    start=beat,
-                    pitch=heuristics.lowest_digit(beat),
-                    amplitude=churchbell_amp,
-                    length=churchbell_length,
-                    comment="; n1s={}, divisors={}, pitch={}, length={}".format(heuristics.ones_in_binary_repr(beat),
-                                                                                heuristics.divisors(beat),
-                                                                                heuristics.lowest_digit(beat),
-                                                                                churchbell_length)
-                )
-
-        # Happy: Plays based on happy numbers. Toggles on/off for each happy number encountered (in base 10). The
-        #   pitch depends on how many bases (16 or less) in which the number is happy, when it's toggled off.
-        if beat in range(298, 378) or beat in range(435, 560) or beat in range(606, 692):
-            is_happy = heuristics.is_happy_number(beat)
-            if is_happy:
-                if happy_play == -1:
-                    happy_play = beat
-                else:
-                    happy_pitch = sum(heuristics.is_happy_number(beat, b) for b in range(2, 17))  # adding booleans
-                    instrs['happy'].add_note(
-                        start=happy_play,
-                        length=beat - happy_play,
-                        pitch=happy_pitch,
-                        comment="; {} --> {} is happy in bases {}".format(happy_play, beat, [b for b in range(2, 17)
-                                                                          if heuristics.is_happy_number(beat, b)])
-                    )
-                    happy_play = -1
-    #
-    return
 
+class Happy(Voice):
+    """
+    Happy: Plays based on happy numbers. Toggles on/off for each happy number encountered (in base 10). The
+      pitch depends on how many bases (16 or less) in which the number is happy, when it's toggled off.
+    """
+    intervals = ((298, 378), (435, 560), (606, 692))
+
+    def __init__(self, instrument):
+        super().__init__(instrument)
+        self.play = -1
+
+    def step(self, beat, props):
+        if not props.is_happy_number():
+            return
+        if self.play == -1:
+            self.play = beat
+            return
+        bases = props.happy_bases(range(2, 17))
+        self.instrument.add_note(
+            start=self.play,
+            length=beat - self.play,
+            pitch=len(bases),
+            comment=("; {} --> {} is happy in bases {}", self.play, beat, bases)
+        )
+        self.play = -1
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == 'custom':
-        with open('custom.orc') as orc_file, open('custom.sco') as sco_file:
-            orc = orc_file.read()
-            sco = sco_file.read()
-            print(orc)
-            print(sco)
-    else:
-        with open('inst.orc') as orc_file:
-            orc = orc_file.read()
 
-        sco = init_score()
-        instruments = init_instruments()
-        beats_total = 810  # at 217 BPM, around 3:41
-        #
-        compose(instruments, beats_total)
-        #
-        for instr in instruments.values():
-            sco += instr.output_note_sequence() + "\n"
-        print(sco)
-        #
-    cout = ctcsound.Csound()
-    cout.setOption("-ocomposition.wav")
-    cout.compileOrc(orc)
-    cout.readScore(sco)
-    cout.start()
-    cout.perform()
-    cout.reset()
+def init_voices(instrs):
+    """
+    Creates the list of Voices (hardcoded) that play the given instruments, and returns them.
+    :param instrs: A dict of Instruments, where key is name/role, as returned by init_instruments()
+    :return: a list of Voice objects, in the order they should play within each beat
+    """
+    return [
+        Bass(instrs['bass']),
+        Quick(instrs['quick']),
+        Long(instrs['long']),
+        High(instrs['high']),
+        Arpeggio(instrs['arpeggio']),
+        Ascent(instrs['ascent']),
+        Erratic(instrs['erratic']),
+        Buzzy(instrs['buzzy']),
+        Churchbell(instrs['churchbell']),
+        Happy(instrs['happy']),
+    ]
+
+
+def _compose_windows(instrs, beat_length, window, voices=None, profiler=None):
+    """
+    Runs a "main loop" from FIRST_BEAT, counting up to beat_length (or forever, if beat_length is None), adding
+    notes for various instruments along the way. A generator: composes window beats at a time, and yields the beat
+    each window ends on once it's composed.
+    """
+    if beat_length is not None:
+        heuristics.sieve(beat_length)
+        heuristics.divisor_sieve(beat_length)
+
+    def properties(beat):
+        return heuristics.NumberProperties(beat)
+
+    scheduler = Scheduler(init_voices(instrs) if voices is None else voices)
+    start = FIRST_BEAT
+    while beat_length is None or start < beat_length:
+        end = start + window if beat_length is None else min(start + window, beat_length)
+        scheduler.run(start, end, properties, profiler)
+        yield end
+        start = end
 
+
+def compose(instrs, beat_length, voices=None, profiler=None):
+    """
+    Runs a "main loop", counting up to beat_length, adding notes for various instruments
+    along the way.
+    :param instrs: A dict of Instruments, where key is name/role. Hard-coded.
+    :param beat_length: How many beats to continue for
+    :param voices: The Voices to play, or None for the ones from init_voices(instrs)
+    :param profiler: Optionally, a profiler.Profiler to record time per voice and per heuristic, and note counts
+    """
+    if profiler is None:
+        for _ in _compose_windows(instrs, beat_length, max(beat_length, 1), voices):
+            pass
+        return
+    heuristics.NumberProperties.reset_stats()
+    start = perf_counter()
+    with profiler.patched(heuristics):
+        for _ in _compose_windows(instrs, beat_length, max(beat_length, 1), voices, profiler):
+            pass
+    profiler.compose_seconds = perf_counter() - start
+    profiler.count_notes(instrs)
+    profiler.count_properties(heuristics.NumberProperties)
+
+
+def compose_stream(instrs, beat_length=None, window=16, voices=None):
+    """
+    Composes like compose(), but only a window of beats at a time, as a generator, so that a performance can start
+    before the piece is composed and can keep counting indefinitely.
+    After each window, yields (end, notes): the beat the window ends on, and the notes added during it, which are
+    taken out of the instruments' note sequences so that memory stays constant however long the piece runs.
+    Some voices add notes that start before the window they're added in (e.g. ascent, once its highest digit
+    changes), so consumers should expect notes that start in the past.
+    :param instrs: A dict of Instruments, where key is name/role. Hard-coded.
+    :param beat_length: How many beats to continue for, or None to continue forever
+    :param window: How many beats to compose between yields
+    :param voices: The Voices to play, or None for the ones from init_voices(instrs)
+    """
+    for end in _compose_windows(instrs, beat_length, window, voices):
+        notes = []
+        for instr in instrs.values():
+            notes += instr.note_sequence
+            instr.note_sequence.clear()
+        yield end, notes
+
+
+def perform(orc, sco, output):
+    """
+    Compiles the given orchestra and score in a fresh Csound instance, and performs it to the given output.
+    :param output: A file name, or "dac" to play through the sound card in real time
+    """
+    import ctcsound
     c = ctcsound.Csound()
-    c.setOption("-odac")    # output to the DAC
+    c.setOption("-o" + output)
     c.compileOrc(orc)
     c.readScore(sco)
     c.start()
@@ -476,4 +623,233 @@ if __name__ == "__main__":
     c.reset()
 
 
+def playback_orchestra(path, orc):
+    """
+    Returns a minimal orchestra, as a string, whose only instrument streams the given sound file to the output
+    for the file's full length. Played with the score "i1 0 1", this replays an already rendered piece without
+    synthesizing it again.
+    :param orc: The orchestra the file was rendered with, whose sample rate and number of channels to match
+    """
+    sr, ksmps, nchnls = render.orchestra_rates(orc)
+    channels = ", ".join("a{}".format(i + 1) for i in range(nchnls))
+    return """
+sr = {1}
+ksmps = {2}
+nchnls = {3}
+
+instr 1
+    Sfile   =       "{0}"
+    p3      =       filelen(Sfile)
+    {4:<7} diskin2 Sfile, 1
+    outc    {4}
+endin
+""".format(path, sr, ksmps, nchnls, channels)
+
+
+def read_orchestra(path, draft=False):
+    """
+    Reads an orchestra from the given file, as a string.
+    :param draft: If True, lowers its sample and control rates for a faster preview (see render.draft_orchestra)
+    """
+    with open(path) as orc_file:
+        orc = orc_file.read()
+    return render.draft_orchestra(orc) if draft else orc
+
 
+def composition_sources():
+    """
+    Returns the source code that determines what compose() adds to the instruments, as a list of strings: the
+    heuristics, instrument and voice modules, and the functions and Voice classes here that set up and run the
+    voices. A change to any of them makes score_cache.score_key() change too.
+    """
+    classes = []
+    for voice in init_voices(init_instruments()):
+        if type(voice) not in classes:
+            classes.append(type(voice))
+    parts = [heuristics, inspect.getmodule(Instrument), inspect.getmodule(Voice), init_instruments, init_voices,
+             _compose_windows] + classes
+    return [inspect.getsource(part) for part in parts]
+
+
+def compose_from_args(args, orc):
+    """
+    Composes the piece as the command-line arguments ask: for how many beats, with profiling, windowed for a
+    preview, analyzed and voice-limited, printing any reports along the way.
+    :param orc: The orchestra the piece will be performed with, to benchmark instruments on for --analyze/--max-load
+    :return: A dict of the composed Instruments, where key is name/role
+    """
+    instruments = init_instruments()
+    beats_total = args.beats  # at 217 BPM, 810 is around 3:41
+    if args.window:
+        # compose at least up to the end of the window, and past it as usual, since some voices add notes that
+        # start earlier than the beat they're added on
+        beats_total = max(beats_total, args.window[1])
+    #
+    cached = None
+    if args.score_cache and not args.profile:
+        key = score_cache.score_key(composition_sources(), beats_total=beats_total, first_beat=FIRST_BEAT,
+                                    tempo=TEMPO)
+        cached = os.path.join(args.score_cache, key)
+    if args.profile:
+        composition_profile = Profiler()
+        compose(instruments, beats_total, profiler=composition_profile)
+        print(composition_profile.summary())
+        composition_profile.write_json(args.profile + ".json")
+        composition_profile.write_csv(args.profile + ".csv")
+    elif cached is None or not score_cache.load_notes(cached, instruments):
+        compose(instruments, beats_total)
+        if cached is not None:
+            os.makedirs(args.score_cache, exist_ok=True)
+            score_cache.save_notes(cached, instruments)
+    if args.window:
+        render.window_notes(instruments.values(), *args.window)
+    #
+    if args.analyze or args.max_load:
+        costs = analysis.measure_costs(orc, init_score(), instruments, tempo=TEMPO)
+        print(analysis.summary(instruments, costs))
+        if args.max_load:
+            for name, cut in analysis.limit_voices(instruments, costs, budget=args.max_load).items():
+                if cut:
+                    print("{}: {} notes dropped, {} shortened".format(name, cut["dropped"], cut["shortened"]))
+    return instruments
+
+
+def score_text(instruments, compact=False):
+    """ Returns the whole score for the given (composed) instruments, as a string. """
+    sco_file = io.StringIO()
+    write_score(sco_file, init_score(), instruments.values(), compact=compact)
+    return sco_file.getvalue()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Composes and performs As The Numbers Say. Only the render, play "
+                                                 "and custom commands need Csound.")
+    commands = parser.add_subparsers(dest="command", metavar="command",
+                                     help="what to do (default: render, then play back the rendered file)")
+
+    composing = argparse.ArgumentParser(add_help=False)
+    composing.add_argument("--beats", type=int, default=810,
+                           help="how many beats to count to (default 810, around 3:41; 0 with --live: forever)")
+    composing.add_argument("--profile", metavar="PREFIX",
+                           help="profile composition: print a summary, and write PREFIX.json and a per-beat "
+                                "PREFIX.csv trace")
+    composing.add_argument("--window", type=int, nargs=2, metavar=("START", "END"),
+                           help="preview only the beats from START up to END: the piece is still composed from the "
+                                "start, but only the notes sounding in the window are performed, from time 0")
+    composing.add_argument("--analyze", action="store_true",
+                           help="print the peak polyphony per instrument, and the CPU load predicted for playing "
+                                "the piece in real time, from a quick benchmark of each instrument (needs Csound)")
+    composing.add_argument("--max-load", type=float, metavar="CORES",
+                           help="drop or shorten the least important notes wherever the predicted CPU load would "
+                                "exceed this many cores (e.g. 0.8), so that real-time playback keeps up "
+                                "(needs Csound)")
+    composing.add_argument("--score-cache", default=".score_cache", metavar="DIR",
+                           help="reuse the notes composed by an earlier run from this directory when nothing that "
+                                "decides them has changed (default .score_cache; '' to disable)")
+    composing.add_argument("--compact", action="store_true",
+                           help="write the score with cSound's carry notation, and without notes that can't sound")
+    drafting = argparse.ArgumentParser(add_help=False)
+    drafting.add_argument("--draft", action="store_true",
+                          help="perform at a lower sample and control rate, to preview faster")
+    performing = argparse.ArgumentParser(add_help=False, parents=[composing, drafting])
+    performing.add_argument("--sco", metavar="PATH",
+                            help="also write the composed score to this file, e.g. to debug --inject")
+    performing.add_argument("--inject", action="store_true",
+                            help="send notes straight to Csound as numeric events instead of as a score to parse (in a "
+                                 "single process: not with --jobs or --stems)")
+    performing.add_argument("--live", action="store_true",
+                            help="compose while performing, a few beats ahead, instead of composing the whole "
+                                 "piece first (only with --beats, --draft and --play)")
+
+    compose_command = commands.add_parser("compose", parents=[composing],
+                                          help="compose the piece and write its score, without Csound")
+    compose_command.add_argument("--sco", metavar="PATH", default="composition.sco",
+                                 help="where to write the score (default composition.sco; '-' for stdout)")
+    render_command = commands.add_parser("render", parents=[performing],
+                                         help="compose the piece and render it to composition.wav")
+    render_command.add_argument("--play", action="store_true",
+                                help="then play back the rendered file")
+    render_command.add_argument("--jobs", type=int, default=1,
+                                help="render in this many processes, each performing a segment of the score "
+                                     "(default 1: a single performance; 0: one process per CPU)")
+    render_command.add_argument("--segment-beats", type=int, default=64,
+                                help="how many beats of the score each process renders at a time, with --jobs")
+    render_command.add_argument("--stems", action="store_true",
+                                help="render each instrument separately (in --jobs processes) to "
+                                     "stems/<name>.wav, then mix them")
+    render_command.add_argument("--stem-cache", default=".stem_cache", metavar="DIR",
+                                help="with --stems, reuse stems rendered by earlier runs from this directory when "
+                                     "their notes and instruments haven't changed (default .stem_cache; '' to "
+                                     "disable)")
+    commands.add_parser("play", parents=[performing], help="compose the piece and play it in real time")
+    custom_command = commands.add_parser("custom", parents=[drafting],
+                                         help="perform custom.orc and custom.sco instead of composing the piece")
+    custom_command.add_argument("--mode", choices=["render", "play", "both"], default="both",
+                                help="render to composition.wav, play in real time, or render once and then play "
+                                     "back the rendered file (default)")
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(["render", "--play"])
+    if args.command in ("render", "play"):
+        # options the chosen way of performing would silently ignore: compose_stream() and perform_stream() take
+        #   none of these, and perform_events() none of the rendering ones (--compact only shapes the --sco file)
+        command_parser = commands.choices[args.command]
+        ignored_with = {
+            "live": ("profile", "window", "analyze", "max_load", "score_cache", "compact", "sco", "inject", "jobs",
+                     "segment_beats", "stems", "stem_cache"),
+            "inject": ("jobs", "segment_beats", "stems", "stem_cache") + (() if args.sco else ("compact",)),
+        }
+        for option, dests in ignored_with.items():
+            ignored = ["--" + dest.replace("_", "-") for dest in dests
+                       if getattr(args, dest, None) != command_parser.get_default(dest)]
+            if getattr(args, option) and ignored:
+                command_parser.error("--{} can't be combined with {}".format(option, ", ".join(ignored)))
+
+    if args.command == "custom":
+        orc = read_orchestra('custom.orc', args.draft)
+        with open('custom.sco') as sco_file:
+            sco = sco_file.read()
+        print(orc)
+        print(sco)
+        perform(orc, sco, "dac" if args.mode == "play" else "composition.wav")
+        if args.mode == "both":
+            perform(playback_orchestra("composition.wav", orc), "i1 0 1\n", "dac")
+        raise SystemExit
+
+    if args.command == "compose":
+        instruments = compose_from_args(args, read_orchestra('inst.orc') if args.analyze or args.max_load else None)
+        if args.sco == "-":
+            print(score_text(instruments, args.compact))
+        else:
+            with open(args.sco, 'w') as sco_file:
+                write_score(sco_file, init_score(), instruments.values(), compact=args.compact)
+        raise SystemExit
+
+    output = "dac" if args.command == "play" else "composition.wav"
+    orc = read_orchestra('inst.orc', args.draft)
+    if args.live:
+        windows = compose_stream(init_instruments(), args.beats or None)
+        render.perform_stream(orc, init_tables(), windows, output, tempo=TEMPO)
+    else:
+        instruments = compose_from_args(args, orc)
+        if args.sco:
+            with open(args.sco, 'w') as sco_file:
+                write_score(sco_file, init_score(), instruments.values(), compact=args.compact)
+        if args.inject:
+            render.perform_events(orc, init_tables(), instruments.values(), output, tempo=TEMPO)
+        else:
+            sco = score_text(instruments, args.compact)
+            print(sco)
+            if args.command == "play":
+                perform(orc, sco, "dac")    # output to the DAC
+            elif args.stems:
+                render.render_stems(orc, init_score(), instruments, output, processes=args.jobs or None,
+                                    cache_dir=args.stem_cache or None)
+            elif args.jobs != 1:
+                render.render_parallel(orc, init_score(), instruments.values(), output,
+                                       segment_beats=args.segment_beats, tempo=TEMPO,
+                                       processes=args.jobs or None)
+            else:
+                perform(orc, sco, output)
+    if args.command == "render" and args.play:
+        perform(playback_orchestra("composition.wav", orc), "i1 0 1\n", "dac")
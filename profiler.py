@@ -0,0 +1,165 @@
+"""
+file: profiler.py
+author: Louis Jacobowitz (ljacobo@ncsu.edu)
+
+An optional profiler for compose(): records how long each voice spends in step(), how long each beat's
+NumberProperties takes to build, how often each function in heuristics is called and how long it takes, the
+NumberProperties cache's hits and misses, how many notes each Instrument plays, and how many notes start on
+each beat. Nothing here runs unless a Profiler is passed to compose().
+"""
+from collections import Counter
+from contextlib import contextmanager
+import csv
+import functools
+import inspect
+import json
+from time import perf_counter
+
+
+class Profiler:
+    """
+    Collects timings and counts during a call to compose(profiler=...), for reporting afterwards with summary(),
+    write_json() and write_csv(). Function times include time spent in other heuristics they call.
+    """
+
+    def __init__(self):
+        self.voice_seconds = Counter()      # voice class name -> seconds in step()
+        self.voice_calls = Counter()        # voice class name -> calls to step()
+        self.function_seconds = Counter()   # heuristics function name -> seconds, inclusive
+        self.function_calls = Counter()     # heuristics function name -> calls
+        self.beat_seconds = {}              # beat -> seconds spent in all voices on that beat
+        self.properties_seconds = {}        # beat -> seconds spent building that beat's NumberProperties
+        self.beat_voices = {}               # beat -> number of voices active on that beat
+        self.notes = {}                     # instrument name -> notes in its sequence
+        self.density = Counter()            # beat -> notes starting during that beat
+        self.property_stats = {}            # NumberProperties property -> {"hits", "misses", "seconds"}
+        self.compose_seconds = 0.0          # seconds in compose() overall, including what isn't broken down here
+
+    def step_beat(self, beat, voices, props):
+        """ Steps each of the given voices through a beat, as the Scheduler would, timing each one. """
+        beat_start = perf_counter()
+        for voice in voices:
+            start = perf_counter()
+            voice.step(beat, props)
+            name = type(voice).__name__
+            self.voice_seconds[name] += perf_counter() - start
+            self.voice_calls[name] += 1
+        self.beat_seconds[beat] = perf_counter() - beat_start
+        self.beat_voices[beat] = len(voices)
+
+    def timed_properties(self, properties):
+        """
+        Returns a wrapper around a Scheduler's properties callback (from a beat to its NumberProperties) that times
+        each call, per beat.
+        """
+        def wrapper(beat):
+            start = perf_counter()
+            try:
+                return properties(beat)
+            finally:
+                self.properties_seconds[beat] = perf_counter() - start
+        return wrapper
+
+    def _timed(self, name, function):
+        """ Returns a wrapper around the given function that counts and times its calls under the given name. """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.function_seconds[name] += perf_counter() - start
+                self.function_calls[name] += 1
+        return wrapper
+
+    @contextmanager
+    def patched(self, module):
+        """
+        Within the with-block, replaces every function defined in the given module (e.g. heuristics) with a
+        wrapper that counts and times its calls, restoring the originals afterwards.
+        """
+        originals = {name: f for name, f in vars(module).items()
+                     if inspect.isfunction(f) and f.__module__ == module.__name__}
+        for name, function in originals.items():
+            setattr(module, name, self._timed(name, function))
+        try:
+            yield self
+        finally:
+            for name, function in originals.items():
+                setattr(module, name, function)
+
+    def count_notes(self, instrs):
+        """ Records how many notes each of the given instruments plays, and how many notes start on each beat. """
+        for name, instr in instrs.items():
+            self.notes[name] = len(instr.note_sequence)
+            for note in instr.note_sequence:
+                self.density[int(note["start"])] += 1
+
+    def count_properties(self, number_properties):
+        """
+        Records the hits, misses and time spent per property from the class-level counters of the given
+        NumberProperties class (see NumberProperties.stats_table()).
+        """
+        self.property_stats = {name: {"hits": number_properties.hits[name],
+                                      "misses": number_properties.misses[name],
+                                      "seconds": number_properties.seconds[name]}
+                               for name in number_properties.misses}
+
+    def as_dict(self):
+        """ Returns everything recorded, as a dict that can be written as JSON. """
+        return {
+            "voices": {name: {"calls": self.voice_calls[name], "seconds": self.voice_seconds[name]}
+                       for name in self.voice_calls},
+            "functions": {name: {"calls": self.function_calls[name], "seconds": self.function_seconds[name]}
+                          for name in self.function_calls},
+            "properties": self.property_stats,
+            "notes": self.notes,
+            "compose_seconds": self.compose_seconds,
+            "beats": [{"beat": beat, "voices": self.beat_voices[beat], "seconds": self.beat_seconds[beat],
+                       "properties_seconds": self.properties_seconds.get(beat, 0.0), "notes": self.density[beat]}
+                      for beat in sorted(self.beat_seconds)],
+        }
+
+    def summary(self):
+        """ Returns the per-voice, per-function and per-instrument results as tables, as a string. """
+        lines = ["{:<28}{:>10}{:>12}{:>12}".format("voice", "calls", "seconds", "us/call")]
+        for name in sorted(self.voice_calls, key=lambda n: -self.voice_seconds[n]):
+            lines.append("{:<28}{:>10}{:>12.4f}{:>12.2f}".format(
+                name, self.voice_calls[name], self.voice_seconds[name],
+                self.voice_seconds[name] / self.voice_calls[name] * 1e6))
+        lines += ["", "{:<28}{:>10}{:>12}{:>12}".format("heuristic (inclusive)", "calls", "seconds", "us/call")]
+        for name in sorted(self.function_calls, key=lambda n: -self.function_seconds[n]):
+            lines.append("{:<28}{:>10}{:>12.4f}{:>12.2f}".format(
+                name, self.function_calls[name], self.function_seconds[name],
+                self.function_seconds[name] / self.function_calls[name] * 1e6))
+        lines += ["", "{:<28}{:>10}{:>10}{:>12}".format("property", "hits", "misses", "seconds")]
+        for name in sorted(self.property_stats, key=lambda n: -self.property_stats[n]["seconds"]):
+            stats = self.property_stats[name]
+            lines.append("{:<28}{:>10}{:>10}{:>12.4f}".format(name, stats["hits"], stats["misses"],
+                                                              stats["seconds"]))
+        lines += ["", "{:<28}{:>10}".format("instrument", "notes")]
+        for name, count in sorted(self.notes.items(), key=lambda item: -item[1]):
+            lines.append("{:<28}{:>10}".format(name, count))
+        if self.density:
+            busiest = max(self.density, key=lambda beat: self.density[beat])
+            lines += ["", "busiest beat: {} ({} notes start)".format(busiest, self.density[busiest])]
+        lines += ["", "compose: {:.4f} s, of which {:.4f} s in voices and {:.4f} s building beat properties".format(
+            self.compose_seconds, sum(self.beat_seconds.values()), sum(self.properties_seconds.values()))]
+        return "\n".join(lines)
+
+    def write_json(self, path):
+        """ Writes everything recorded to the given path, as JSON. """
+        with open(path, 'w') as json_file:
+            json.dump(self.as_dict(), json_file, indent=2)
+
+    def write_csv(self, path):
+        """
+        Writes the per-beat trace (active voices, seconds in voices, seconds building properties, notes starting) to
+        the given path, as CSV.
+        """
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["beat", "voices", "seconds", "properties_seconds", "notes"])
+            for beat in sorted(self.beat_seconds):
+                writer.writerow([beat, self.beat_voices[beat], self.beat_seconds[beat],
+                                 self.properties_seconds.get(beat, 0.0), self.density[beat]])
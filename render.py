@@ -0,0 +1,368 @@
+"""
+file: render.py
+author: Louis Jacobowitz (ljacobo@ncsu.edu)
+
+Offline rendering of a composed score across several processes, each performing part of it (a time segment,
+or a single instrument's stem) in its own Csound instance, mixed back together into a single WAV file.
+Also performs composed notes by sending them to Csound directly as events, without a score.
+"""
+import hashlib
+from instrument import iter_merged_notes
+import multiprocessing
+import numpy as np
+import os
+import re
+import wave
+
+
+def orchestra_rates(orc):
+    """
+    Reads the sample rate, control period and number of channels from an orchestra's header.
+    Settings the orchestra doesn't give are assumed to be Csound's defaults.
+    :return: A tuple (sr, ksmps, nchnls)
+    """
+    def setting(name, default):
+        match = re.search(r'^\s*{}\s*=\s*(\d+)'.format(name), orc, re.MULTILINE)
+        return int(match.group(1)) if match else default
+    return setting("sr", 44100), setting("ksmps", 10), setting("nchnls", 1)
+
+
+def draft_orchestra(orc, sr=22050, ksmps=50):
+    """
+    Returns the given orchestra with a lower sample rate and control rate, for quick previews. With the defaults,
+    against inst.orc's sr = 44100 and ksmps = 10, there are half the samples and a tenth of the control periods to
+    compute, at the cost of aliasing in the highest overtones and coarser envelopes.
+    :param sr: The sample rate to use instead
+    :param ksmps: The control period to use instead, in samples; must divide sr
+    """
+    if sr % ksmps:
+        raise ValueError("ksmps must divide sr, so that the control rate is a whole number")
+    for name, value in (("sr", sr), ("kr", sr // ksmps), ("ksmps", ksmps)):
+        orc, count = re.subn(r'^(\s*{}\s*=\s*)\d+'.format(name), r'\g<1>{}'.format(value), orc, flags=re.MULTILINE)
+        if not count:
+            orc = "{} = {}\n".format(name, value) + orc
+    return orc
+
+
+def orchestra_blocks(orc):
+    """
+    Splits an orchestra into its global header (everything before the first instrument) and its instruments.
+    :return: A tuple (header, blocks), where blocks is a dict from instrument number to the text from its "instr"
+             line through its "endin" line
+    """
+    blocks = {}
+    pattern = re.compile(r'^\s*instr\s+(\d+).*?^\s*endin\b', re.MULTILINE | re.DOTALL)
+    for match in pattern.finditer(orc):
+        blocks[int(match.group(1))] = match.group(0)
+    first = pattern.search(orc)
+    return (orc[:first.start()] if first else orc), blocks
+
+
+def stem_key(orc, header, instr):
+    """
+    Returns a hash identifying everything that determines how an Instrument's stem sounds: its notes as they'd be
+    written to the score, the orchestra's global header and the "instr" blocks it plays, and the score header.
+    """
+    globals_, blocks = orchestra_blocks(orc)
+    numbers = sorted({int(instr.short_instrument.lstrip("i")), int(instr.long_instrument.lstrip("i"))})
+    digest = hashlib.sha256()
+    for part in [globals_] + [blocks.get(n, "") for n in numbers] + [header]:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    for line in instr.iter_lines():
+        digest.update(line.encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def render_samples(orc, sco):
+    """
+    Performs the given orchestra and score without writing any sound file, and returns everything sent to the
+    output, as a float array with one row per sample frame and one column per channel, scaled so 0dBFS is 1.0.
+    """
+    import ctcsound
+    c = ctcsound.Csound()
+    c.setOption("-n")   # no sound output; samples are collected from spout after each control period
+    c.compileOrc(orc)
+    c.readScore(sco)
+    c.start()
+    spout = c.spout()   # a view of Csound's output buffer, refilled on every control period
+    # filled by slicing, and doubled whenever it's full, rather than kept as one small array per control period
+    samples = np.empty(int(c.sr()) * c.nchnls(), dtype=np.float64)
+    filled = 0
+    while c.performKsmps() == 0:
+        if filled + len(spout) > len(samples):
+            grown = np.empty(2 * len(samples), dtype=np.float64)
+            grown[:filled] = samples[:filled]
+            samples = grown
+        samples[filled:filled + len(spout)] = spout
+        filled += len(spout)
+    samples = samples[:filled].reshape(-1, c.nchnls())
+    samples /= c.get0dBFS()
+    c.reset()
+    return samples
+
+
+def _render_job(job):
+    """ Renders one (key, orchestra, score) job in a worker process. Returns (key, samples). """
+    key, orc, sco = job
+    return key, render_samples(orc, sco)
+
+
+def _mix_into(mix, offset, samples):
+    """
+    Adds samples into mix starting at the given frame offset, and returns the mix, grown if it was too short.
+    Grows geometrically, since parts can finish in any order.
+    """
+    end = offset + len(samples)
+    if end > len(mix):
+        mix = np.concatenate([mix, np.zeros((max(end, 2 * len(mix)) - len(mix), mix.shape[1]))])
+    mix[offset:end] += samples
+    return mix
+
+
+def split_score(orc, header, instruments, segment_beats=64, tempo=217):
+    """
+    Splits the notes of the given instruments into segments of segment_beats beats, by start time.
+    Every note belongs to the segment it starts in, and is rendered there in full, so notes sounding across a
+    boundary (and their release tails) overlap into the next segment and are added to it when mixing.
+    Each segment's notes are moved earlier by a whole number of control periods, so they fall on the same
+    control periods (and so the same samples) as they would in a single performance of the whole score.
+    :param orc: The orchestra, to read the sample rate and control period from
+    :param header: The score's header (f-tables, tempo), repeated at the top of every segment
+    :param instruments: An iterable of Instruments whose notes to split
+    :param segment_beats: How many beats each segment covers
+    :param tempo: The tempo set in the header, in beats per minute
+    :return: A list of (offset in sample frames, score) pairs, one per segment that has notes
+    """
+    sr, ksmps, nchnls = orchestra_rates(orc)
+    segments = {}
+    for instr in instruments:
+        for note in instr.note_sequence:
+            segments.setdefault(int(note["start"] // segment_beats), []).append(note)
+    jobs = []
+    for k, notes in sorted(segments.items()):
+        blocks = int(k * segment_beats * 60 / tempo * sr / ksmps)
+        offset_beats = blocks * ksmps / sr * tempo / 60
+        lines = [note.line(start=max(note["start"] - offset_beats, 0)) for note in notes]
+        jobs.append((blocks * ksmps, header + "\n".join(lines) + "\n"))
+    return jobs
+
+
+def window_notes(instruments, first, last):
+    """
+    Cuts the given instruments' notes down to those sounding during the beats [first, last), moved earlier so that
+    the window starts on beat 0, for previewing part of the piece. A note that started before the window starts
+    on beat 0 instead, shortened to end when it would have; one still sounding at the end of the window is left
+    to finish. Changes the instruments' note sequences in place.
+    :param instruments: An iterable of Instruments
+    :param first: The first beat of the window
+    :param last: The beat the window ends on (exclusive)
+    """
+    for instr in instruments:
+        notes = []
+        for note in instr.note_sequence:
+            start = note["start"]
+            end = start + note["duration"]
+            if end <= first or start >= last:
+                continue
+            if start < first:
+                notes.append(note.replace(start=0, duration=end - first))
+            else:
+                notes.append(note.replace(start=start - first))
+        instr.note_sequence = notes
+
+
+def write_wav(path, samples, sr):
+    """
+    Writes float samples (one row per frame, one column per channel, full scale at 1.0) to a 16-bit WAV file,
+    clipping anything louder than full scale.
+    """
+    frames = np.clip(np.round(samples * 32767), -32768, 32767).astype('<i2')
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(samples.shape[1])
+        out.setsampwidth(2)
+        out.setframerate(sr)
+        out.writeframes(frames.tobytes())
+
+
+def render_parallel(orc, header, instruments, path, segment_beats=64, tempo=217, processes=None):
+    """
+    Renders a score to a WAV file by performing segments of it in a pool of worker processes, then adding the
+    segments together at their offsets. Apart from any random noise inside the instruments, the result matches
+    a single performance of the whole score.
+    :param orc: The orchestra, as a string
+    :param header: The score's header (f-tables, tempo), as a string
+    :param instruments: An iterable of Instruments whose notes to render
+    :param path: The WAV file to write
+    :param segment_beats: How many beats each segment covers
+    :param tempo: The tempo set in the header, in beats per minute
+    :param processes: How many worker processes to use, or None for one per CPU
+    """
+    sr, ksmps, nchnls = orchestra_rates(orc)
+    jobs = [(offset, orc, sco) for offset, sco in split_score(orc, header, instruments, segment_beats, tempo)]
+    mix = np.zeros((0, nchnls))
+    length = 0
+    with multiprocessing.Pool(processes) as pool:
+        for offset, samples in pool.imap_unordered(_render_job, jobs):
+            mix = _mix_into(mix, offset, samples)
+            length = max(length, offset + len(samples))
+    write_wav(path, mix[:length], sr)
+
+
+def render_stems(orc, header, instruments, path, stem_dir="stems", processes=None, cache_dir=None):
+    """
+    Renders each instrument's notes as its own stem, in a pool of worker processes, writes each stem to a WAV file,
+    and writes their sum to another. The orchestra's instruments each write straight to the output with no shared
+    bus, so the sum matches a single performance of the whole score.
+    If a cache directory is given, each rendered stem is also saved there under its stem_key(), and stems whose key
+    is already there are loaded instead of rendered again.
+    :param orc: The orchestra, as a string
+    :param header: The score's header (f-tables, tempo), as a string
+    :param instruments: A dict of Instruments, where key is name/role; each stem is written as <name>.wav
+    :param path: The WAV file to write the mix to
+    :param stem_dir: The directory to write the stems to, created if needed
+    :param processes: How many worker processes to use, or None for one per CPU
+    :param cache_dir: The directory to keep rendered stems in between runs, created if needed, or None for no cache
+    """
+    sr, ksmps, nchnls = orchestra_rates(orc)
+    os.makedirs(stem_dir, exist_ok=True)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    mix = np.zeros((0, nchnls))
+    length = 0
+
+    def add_stem(name, samples):
+        nonlocal mix, length
+        write_wav(os.path.join(stem_dir, name + ".wav"), samples, sr)
+        mix = _mix_into(mix, 0, samples)
+        length = max(length, len(samples))
+
+    jobs = []
+    cached = {}
+    for name, instr in instruments.items():
+        if not instr.note_sequence:
+            continue
+        if cache_dir is not None:
+            cached[name] = os.path.join(cache_dir, stem_key(orc, header, instr) + ".npy")
+            if os.path.exists(cached[name]):
+                add_stem(name, np.load(cached[name]))
+                continue
+        jobs.append((name, orc, header + instr.output_note_sequence() + "\n"))
+    if jobs:
+        with multiprocessing.Pool(processes) as pool:
+            for name, samples in pool.imap_unordered(_render_job, jobs):
+                # stems are cached as float32, so fresh ones are mixed at that precision too: otherwise a run that
+                #   renders them and one that loads them from the cache would write different mixes
+                samples = samples.astype(np.float32)
+                if name in cached:
+                    # saved under a temporary name and then renamed, so an interrupted run can't leave a
+                    #   truncated stem that later runs would take for a cached one
+                    temporary = "{}.{}.tmp.npy".format(cached[name][:-len(".npy")], os.getpid())
+                    np.save(temporary, samples)
+                    os.replace(temporary, cached[name])
+                add_stem(name, samples)
+    write_wav(path, mix[:length], sr)
+
+
+def create_tables(c, tables):
+    """
+    Creates the given function tables in a started Csound instance, without a score: as "f" events when all their
+    arguments are numbers, or with ftgen when one is a string (e.g. a sound file name).
+    :param c: A started ctcsound.Csound
+    :param tables: A list of (table number, size, GEN routine number, list of GEN arguments, comment) tuples
+    """
+    for number, size, gen, args, comment in tables:
+        if any(type(arg) == str for arg in args):
+            c.compileOrc("gitable{0} ftgen {0}, 0, {1}, {2}, {3}".format(number, size, gen,
+                                                                        ", ".join(str(arg) for arg in args)))
+        else:
+            c.scoreEvent('f', [number, 0, size, gen] + args)
+
+
+def perform_events(orc, tables, instruments, output, tempo=217, lookahead=1.0):
+    """
+    Performs the notes of the given instruments by sending each straight to Csound as an event of numeric
+    p-fields, instead of writing a score and having Csound parse it. Notes are sent in time order, in batches
+    that stay `lookahead` seconds ahead of the performance, and the performance ends when the last note does.
+    :param orc: The orchestra, as a string
+    :param tables: The function tables to create, as for create_tables()
+    :param instruments: An iterable of Instruments whose notes to perform
+    :param output: A file name, or "dac" to play through the sound card in real time
+    :param tempo: The tempo to play the notes' beats at, in beats per minute
+    :param lookahead: How far ahead of the performance to send notes, in seconds
+    """
+    import ctcsound
+    c = ctcsound.Csound()
+    c.setOption("-o" + output)
+    c.compileOrc(orc)
+    c.start()
+    create_tables(c, tables)
+    seconds_per_beat = 60 / tempo
+    notes = iter_merged_notes(instruments)
+    note = next(notes, None)
+    end = 0
+    while True:
+        now = c.scoreTime()
+        while note is not None and note["start"] * seconds_per_beat < now + lookahead:
+            end = max(end, _send_note(c, note, seconds_per_beat, now))
+            note = next(notes, None)
+        if (note is None and now >= end) or c.performKsmps() != 0:
+            break
+    c.reset()
+
+
+def _send_note(c, note, seconds_per_beat, now):
+    """
+    Sends a note to a running Csound instance as an event, with its start and duration converted from beats to
+    seconds. A note that should already have started is started now and shortened to end on time, or dropped if it
+    should already have ended.
+    :return: The time, in seconds, at which the note ends
+    """
+    pfields = note.pfields()
+    start = pfields[1] * seconds_per_beat
+    end = start + pfields[2] * seconds_per_beat
+    if end <= now:
+        return end
+    pfields[1] = max(start, now)
+    pfields[2] = end - pfields[1]
+    c.scoreEventAbsolute('i', pfields, 0)
+    return end
+
+
+def perform_stream(orc, tables, windows, output, tempo=217, lookahead=4):
+    """
+    Performs notes as they're composed: pulls windows of notes from a generator such as main.compose_stream()
+    while the performance runs, staying `lookahead` beats ahead of it, and sends each note straight to Csound as
+    an event. Sound starts as soon as the first window is composed, and the performance lasts as long as the
+    generator keeps yielding. Notes that arrive after they should have started are started late and shortened.
+    :param orc: The orchestra, as a string
+    :param tables: The function tables to create, as for create_tables()
+    :param windows: An iterator of (end beat, notes) pairs, in order
+    :param output: A file name, or "dac" to play through the sound card in real time
+    :param tempo: The tempo to play the notes' beats at, in beats per minute
+    :param lookahead: How far ahead of the performance to compose, in beats
+    """
+    import ctcsound
+    c = ctcsound.Csound()
+    c.setOption("-o" + output)
+    c.compileOrc(orc)
+    c.start()
+    create_tables(c, tables)
+    seconds_per_beat = 60 / tempo
+    composed_until = 0
+    finished = False
+    end = 0
+    while True:
+        now = c.scoreTime()
+        while not finished and composed_until * seconds_per_beat < now + lookahead * seconds_per_beat:
+            try:
+                composed_until, notes = next(windows)
+            except StopIteration:
+                finished = True
+                break
+            for note in notes:
+                end = max(end, _send_note(c, note, seconds_per_beat, now))
+        if (finished and now >= end) or c.performKsmps() != 0:
+            break
+    c.reset()
@@ -0,0 +1,124 @@
+"""
+file: score_cache.py
+author: Louis Jacobowitz (ljacobo@ncsu.edu)
+
+An on-disk cache of composed notes, so that running the piece again with nothing changed skips compose() entirely.
+Each Instrument's notes are stored as a NumPy structured array (one record per note, one column per field), and
+their comments as one block of text, all in .npy files. Loading memory-maps the files, but then builds Notes from
+them a whole column at a time, since everything downstream works with Notes: it is a fast load, not a zero-copy one.
+"""
+import hashlib
+import inspect
+from instrument import Note, Pitch
+import json
+import numpy as np
+import os
+import sys
+
+
+def score_key(sources, **parameters):
+    """
+    Returns a hash identifying a composition: the source code that determines what gets composed, the parameters
+    it was composed with (e.g. beats_total, the first beat and the tempo), and this module's own source, so that
+    entries saved in an older storage format are never loaded.
+    :param sources: A list of strings of source code
+    """
+    digest = hashlib.sha256()
+    for source in list(sources) + [inspect.getsource(sys.modules[__name__])]:
+        digest.update(source.encode())
+        digest.update(b"\0")
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _note_dtype(instr):
+    """
+    Returns the structured dtype to store an Instrument's notes in: the cSound instrument as bytes, the pitch as its
+    number of half-steps, the comment as where it ends in the comment text, and every other field as a float,
+    alongside a flag for whether it was an int, so that it's written to the score exactly as before.
+    """
+    columns = []
+    for key in instr.fields:
+        if key == "instrument":
+            columns.append((key, "S8"))
+        elif key == "pitch":
+            columns.append((key, "i4"))
+        elif key == "comment":
+            columns.append((key, "i8"))
+        else:
+            columns += [(key, "f8"), (key + "_is_int", "?")]
+    return np.dtype(columns)
+
+
+def save_notes(path, instruments):
+    """
+    Saves the notes of the given (composed) instruments to a new directory at the given path, as <name>.npy and
+    <name>.comments.npy per Instrument. Written to a temporary directory first and then renamed, so that a run
+    that's interrupted never leaves a partial entry behind.
+    :param instruments: A dict of Instruments, where key is name/role
+    """
+    temporary = "{}.{}.tmp".format(path, os.getpid())
+    os.makedirs(temporary)
+    for name, instr in instruments.items():
+        notes = np.zeros(len(instr.note_sequence), dtype=_note_dtype(instr))
+        columns = list(zip(*(note.values for note in instr.note_sequence))) or [()] * len(instr.fields)
+        comments = []
+        for key, column in zip(instr.fields, columns):
+            if key == "instrument":
+                notes[key] = [value.encode() for value in column]
+            elif key == "pitch":
+                notes[key] = [value.semitone for value in column]
+            elif key == "comment":
+                comments = [note[key] for note in instr.note_sequence]
+                notes[key] = np.cumsum([len(comment) for comment in comments])
+            else:
+                notes[key] = column
+                notes[key + "_is_int"] = [type(value) == int for value in column]
+        np.save(os.path.join(temporary, name + ".npy"), notes)
+        np.save(os.path.join(temporary, name + ".comments.npy"), np.frombuffer("".join(comments).encode(), np.uint8))
+    try:
+        os.rename(temporary, path)
+    except OSError:
+        # another run saved the same composition first
+        for file_name in os.listdir(temporary):
+            os.remove(os.path.join(temporary, file_name))
+        os.rmdir(temporary)
+
+
+def _load(path):
+    """ Memory-maps the array in the given .npy file (or reads it, if it's empty and so can't be mapped). """
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        return np.load(path)
+
+
+def load_notes(path, instruments):
+    """
+    Replaces the note sequences of the given (newly created) instruments with the notes saved at the given path by
+    save_notes(), if there are any. Every note is turned back into a Note here, converting the arrays to Python
+    values one column at a time.
+    :param instruments: A dict of Instruments, where key is name/role, as created by init_instruments()
+    :return: True if the notes were loaded, False if nothing is saved at the path
+    """
+    if not os.path.isdir(path):
+        return False
+    for name, instr in instruments.items():
+        notes = _load(os.path.join(path, name + ".npy"))
+        text = _load(os.path.join(path, name + ".comments.npy")).tobytes().decode()
+        columns = []
+        for key in instr.fields:
+            if key == "instrument":
+                columns.append(notes[key].astype(str).tolist())
+            elif key == "pitch":
+                columns.append([Pitch(semitone) for semitone in notes[key].tolist()])
+            elif key == "comment":
+                ends = notes[key].tolist()
+                columns.append([text[start:end] for start, end in zip([0] + ends, ends)])
+            elif notes[key + "_is_int"].all():
+                columns.append(notes[key].astype(np.int64).tolist())
+            else:
+                columns.append([int(value) if is_int else value
+                                for value, is_int in zip(notes[key].tolist(), notes[key + "_is_int"].tolist())])
+        instr.note_sequence = [Note(instr.field_index, values) for values in zip(*columns)]
+    return True
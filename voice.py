@@ -0,0 +1,92 @@
+"""
+file: voice.py
+author: Louis Jacobowitz (ljacobo@ncsu.edu)
+
+The plugin API for voices: each Voice decides, beat by beat, what notes its Instrument plays, and a Scheduler
+dispatches each beat only to the voices active on it.
+"""
+from bisect import bisect_right
+
+
+class Voice:
+    """
+    A single part in the piece. Subclasses declare the beats on which they're active in `intervals`, keep whatever
+    state they need as attributes, and add notes to their Instrument in step().
+    """
+    # Half-open (start, stop) beat ranges in which this voice is active, or None to be active on every beat
+    intervals = None
+
+    def __init__(self, instrument):
+        """
+        :param instrument: The Instrument this voice adds notes to
+        """
+        self.instrument = instrument
+
+    def step(self, beat, props):
+        """
+        Called once for each beat on which this voice is active, in ascending order.
+        :param beat: The current beat
+        :param props: A heuristics.NumberProperties for the current beat, shared with the other voices
+        """
+        raise NotImplementedError
+
+
+class Scheduler:
+    """
+    Precomputes, for a set of voices, the beats at which the set of active voices changes, so that each beat can be
+    dispatched to only the voices active on it without testing every voice's intervals on every beat.
+    """
+
+    def __init__(self, voices):
+        """
+        :param voices: The voices to schedule, in the order they should be stepped within a beat
+        """
+        self.voices = list(voices)
+        boundaries = set()
+        for voice in self.voices:
+            for start, stop in voice.intervals or ():
+                boundaries.update((start, stop))
+        self.boundaries = sorted(boundaries)
+        # self.active[i] holds the voices active from boundaries[i-1] up to boundaries[i] (with the ends open)
+        self.active = [self._active_at(b - 1) for b in self.boundaries] + [self._active_at(self.boundaries[-1])
+                                                                            if self.boundaries else self.voices]
+
+    def _active_at(self, beat):
+        """ Returns the voices active on the given beat, by checking each voice's intervals. """
+        return [v for v in self.voices if v.intervals is None or any(a <= beat < b for a, b in v.intervals)]
+
+    def active_at(self, beat):
+        """ Returns the voices active on the given beat, using the precomputed index. """
+        return self.active[bisect_right(self.boundaries, beat)]
+
+    def segments(self, first, last):
+        """
+        Yields (start, stop, voices) for each run of beats in [first, last) over which the active voices don't
+        change, in order.
+        """
+        start = first
+        i = bisect_right(self.boundaries, first)
+        while start < last:
+            stop = min(self.boundaries[i], last) if i < len(self.boundaries) else last
+            yield start, stop, self.active[i]
+            start = stop
+            i += 1
+
+    def run(self, first, last, properties, profiler=None):
+        """
+        Steps every voice through the beats in [first, last).
+        :param properties: A function from a beat to the NumberProperties to pass to the voices on that beat.
+                           It is called on every beat, even those where no voice is active.
+        :param profiler: Optionally, a profiler.Profiler to step the voices through each beat and time them, and to
+                         time the properties callback
+        """
+        if profiler is not None:
+            properties = profiler.timed_properties(properties)
+        for start, stop, voices in self.segments(first, last):
+            for beat in range(start, stop):
+                props = properties(beat)
+                if profiler is not None:
+                    profiler.step_beat(beat, voices, props)
+                    continue
+                for voice in voices:
+                    voice.step(beat, props)